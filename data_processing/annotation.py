@@ -6,10 +6,13 @@ Created on Fri Nov 17 21:14:11 2023
 @author: huangpaveen
 """
 
-import re
 import os
+import heapq
+import itertools
 import data_forge as DataF
 import remedy as RM
+import matcher as MT
+import voting as VT
 import json
 
 PhiCategory = [
@@ -33,11 +36,8 @@ def get_anno_format(sentence, infos, boundary):
     anno_list = []
     boundary = int(boundary)
     
-    # label dectction
-    infos = RM.detection(sentence, infos)
-
-    # Extract label information and clean it
-    label_infos = DataF.extract_label_info(infos)
+    # Extract label information once, then label dectction and clean it
+    label_infos = RM.detection(sentence, DataF.extract_label_info(infos))
     phi_dict = {}
 
     for label_info in label_infos:        
@@ -53,24 +53,18 @@ def get_anno_format(sentence, infos, boundary):
         #     phi_dict[label_info[0]] = label_info[1].strip()
 
     # Find matches in the sentence and add to annotations
-    for phi_value, phi_key in phi_dict.items():
-        try:
-            matches = [(m.start(), m.end()) for m in re.finditer(re.escape(phi_value), sentence)]
-        except re.error:
+    phi_values = tuple(phi_dict.keys())
+    for start, end, value_idx in MT.build_matcher(phi_values).finditer(sentence):
+        if start == end:
             continue
-
-        for start, end in matches:
-            if start == end:
-                continue
-            # if phi_value == "eh":
-            #     print()
-            item_dict = {
-                "phi": phi_key,
-                "st_idx": start + boundary,
-                "ed_idx": end + boundary,
-                "entity": phi_value,
-            }
-            anno_list.append(item_dict)
+        phi_value = phi_values[value_idx]
+        item_dict = {
+            "phi": phi_dict[phi_value],
+            "st_idx": start + boundary,
+            "ed_idx": end + boundary,
+            "entity": phi_value,
+        }
+        anno_list.append(item_dict)
 
     return anno_list
 
@@ -86,9 +80,9 @@ def construct_output_dict(outputs):
         parts = output.split("\t")
         if len(parts) < 5:
             continue
-        key = (parts[0], parts[1], parts[2], parts[3])
+        key = (parts[0], parts[1], int(parts[2]), int(parts[3]))
         if key not in output_dict:
-            output_dict[key] = {"count": 1, "output": output}
+            output_dict[key] = {"count": 1, "output": output, "end": key[3]}
         else:
             output_dict[key]["count"] += 1
     return output_dict
@@ -110,7 +104,7 @@ def organize_by_max_end_pos(output_dict):
     for key, value_list in output_dict.items():
         file_id = key[0]
         # 找到最大的end_pos
-        max_end_pos = max(value["output"].split("\t")[3] for value in value_list)
+        max_end_pos = max(value["end"] for value in value_list)
 
         new_key = (file_id, max_end_pos)
         if new_key not in max_end_pos_dict:
@@ -167,11 +161,160 @@ def write_to_file(best_output_dict, output_file):
             file.write(value + "\n")
 
 
+"""Streaming ensemble"""
+
+
+def parse_prediction(line):
+    """
+    split a prediction line into (fid, idx, content, prediction), None if incomplete
+    """
+    parts = line.decode("utf-8-sig").strip().split("\t")
+    if len(parts) != 4:
+        return None
+    return parts
+
+
+def find_sorted_runs(pred_path):
+    """
+    byte ranges of the runs of a prediction file in which fid is non-decreasing
+    (validation files are original + sliced + spliced, each sorted by fid)
+    """
+    runs = []
+    run_start, offset, last_fid = 0, 0, None
+    with open(pred_path, "rb") as fr:
+        for line in fr:
+            parts = parse_prediction(line)
+            if parts:
+                if last_fid is not None and parts[0] < last_fid:
+                    runs.append((run_start, offset))
+                    run_start = offset
+                last_fid = parts[0]
+            offset += len(line)
+    runs.append((run_start, offset))
+    return runs
+
+
+def read_run(pred_path, start, end):
+    with open(pred_path, "rb") as fr:
+        fr.seek(start)
+        offset = start
+        while offset < end:
+            line = fr.readline()
+            if not line:
+                break
+            offset += len(line)
+            parts = parse_prediction(line)
+            if parts:
+                yield parts
+
+
+def read_model_runs(pred_path, model_idx):
+    return [
+        ((model_idx, parts) for parts in read_run(pred_path, start, end))
+        for start, end in find_sorted_runs(pred_path)
+    ]
+
+
+def merge_predictions(pred_paths):
+    """
+    k-way merge of the prediction files by fid
+    within a fid, lines keep the order of the concatenated files
+
+    output : (fid, [(model_idx, prediction parts)]) for each fid
+    """
+    runs = [run for model_idx, path in enumerate(pred_paths) for run in read_model_runs(path, model_idx)]
+    merged = heapq.merge(*runs, key=lambda x: x[1][0])
+    for fid, group in itertools.groupby(merged, key=lambda x: x[1][0]):
+        yield fid, list(group)
+
+
+def annotate_predictions(predictions):
+    """
+    output : (model_idx, answer line) list
+    """
+    outputs = []
+    for model_idx, (fid, idx, content, prediction) in predictions:
+        annotations = get_anno_format(content, prediction, idx)
+        for annotation in annotations:
+            outputs.append(
+                (model_idx, f'{fid}\t{annotation["phi"]}\t{annotation["st_idx"]}\t{annotation["ed_idx"]}\t{annotation["entity"]}')
+            )
+    return outputs
+
+
+def write_json_entries(file, pos_dict, first):
+    """
+    append entries to a json object written incrementally (same layout as json.dump(indent=4))
+    """
+    for k, v in pos_dict.items():
+        value = json.dumps(v, ensure_ascii=False, indent=4).replace("\n", "\n    ")
+        file.write(("{\n" if first else ",\n") + f"    {json.dumps(str(k), ensure_ascii=False)}: {value}")
+        first = False
+    return first
+
+
+def vote_by_count(annotated):
+    """
+    original vote: raw counts grouped by start and max end position
+    the grouping is the same as before the interval index, except that the max end is compared as an int
+    ("100" used to lose to "99"), overlapping spans are only merged by the weighted vote
+    """
+    output_dict = construct_output_dict([output for _, output in annotated])
+    start_pos_dict = organize_by_start_pos(output_dict)
+    pos_dict = organize_by_max_end_pos(start_pos_dict)
+    best_output_dict = select_best_output(pos_dict)
+    outputs = [value for _, value in sorted(best_output_dict.items(), key=lambda x: x[0][1])]
+    # the dict json keeps its original layout: string end positions, entries without the parsed end
+    vote_dict = {
+        (fid, str(end)): [{"count": value["count"], "output": value["output"]} for value in values]
+        for (fid, end), values in pos_dict.items()
+    }
+    return outputs, vote_dict
+
+
+def vote_by_weight(fid, annotated, weights, min_confidence=0.0):
+    """
+    weighted vote (voting.weighted_vote) with interval scheduling of overlapping spans
+    """
+    selected = VT.weighted_vote(annotated, weights, min_confidence)
+    outputs = [candidate["output"] for _, candidate in selected]
+    vote_dict = {(fid,) + key: candidate for key, candidate in selected}
+    return outputs, vote_dict
+
+
+def ensemble_predictions(pred_paths, output_path, dict_path=None, weights=None, min_confidence=0.0):
+    """
+    vote over the predictions of one or more models, one fid at a time,
+    so memory is bounded by a single report instead of the whole corpus
+
+    weights : per-model {category: weight} list (voting.load_weights / compute_weights),
+              None keeps the original count vote
+    """
+    dict_file = open(dict_path, "w", encoding="utf-8") if dict_path else None
+    first = True
+    try:
+        with open(output_path, "w", encoding="utf-8") as file:
+            for fid, predictions in merge_predictions(pred_paths):
+                annotated = annotate_predictions(predictions)
+                if weights is None:
+                    outputs, vote_dict = vote_by_count(annotated)
+                else:
+                    outputs, vote_dict = vote_by_weight(fid, annotated, weights, min_confidence)
+
+                for output in outputs:
+                    file.write(output + "\n")
+                if dict_file:
+                    first = write_json_entries(dict_file, vote_dict, first)
+    finally:
+        if dict_file:
+            dict_file.write("{}" if first else "\n}")
+            dict_file.close()
+
+
 if __name__ == "__main__":
 
-    total = []
-    outputs = []
     total_time = []
+    pred_paths = []
 
     
     # name_list = ["prediction_1701317300.txt", "prediction_1701181213.txt"]
@@ -189,9 +332,7 @@ if __name__ == "__main__":
         time = name[11:-4]
         path = os.path.join(os.getcwd(), "Result/val")
         # path = os.path.join(os.getcwd(), "Result")
-        pred_path = os.path.join(path, name)
-        lines = read_file(pred_path)
-        total += lines
+        pred_paths.append(os.path.join(path, name))
         total_time.append(time)
 
     out_time = "_".join(total_time)
@@ -199,28 +340,12 @@ if __name__ == "__main__":
     output_path = os.path.join(path, f"answer_{out_time}.txt")
     dict_path = os.path.join(path, f"dict_{out_time}.json")
 
-    for line in total:
-        if len(line.strip().split("\t")) != 4:
-            # print("[WARNING]No prediction: ", line)
-            continue
-        fid, idx, content, prediction = line.strip().split("\t")
-        # if fid != "1001":
-        #     continue
-        annotations = get_anno_format(content, prediction, idx)
-        for annotation in annotations:
-            outputs.append(
-                f'{fid}\t{annotation["phi"]}\t{annotation["st_idx"]}\t{annotation["ed_idx"]}\t{annotation["entity"]}'
-            )
-
-    output_dict = construct_output_dict(outputs)
-    start_pos_dict = organize_by_start_pos(output_dict)
-    pos_dict = organize_by_max_end_pos(start_pos_dict)
-    best_output_dict = select_best_output(pos_dict)
+    # weighted vote: per-category F1 of each model's own answer file as weights
+    # weights = VT.compute_weights(
+    #     [os.path.join(path, f"answer_{t}.txt") for t in total_time],
+    #     os.path.join(path, "answer_val_phase1.txt"))
+    weights = None
 
-    write_to_file(best_output_dict, output_path)
-    
-    json_compatible_dict = {str(k): v for k, v in pos_dict.items()}
-    with open(dict_path, 'w', encoding='utf-8') as f:
-        json.dump(json_compatible_dict, f, ensure_ascii=False, indent=4)
+    ensemble_predictions(pred_paths, output_path, dict_path, weights)
 
     print(out_time)
@@ -7,12 +7,29 @@ Created on Sun Nov 26 10:10:24 2023
 """
 
 import os
+import bisect
 import numpy as np
 import torch
 import random
+from concurrent.futures import ProcessPoolExecutor
 
 import data_forge as DataF
 
+bos = "<|endoftext|>"
+eos = "<|END|>"
+pad = "<|pad|>"
+ner = "\n\n####\n\n"
+special_tokens_dict = {
+    "bos_token": bos,
+    "eos_token": eos,
+    "pad_token": pad,
+    "sep_token": ner,
+}
+
+MaxLen = 128
+PHINull = "PHI:Null"
+RandomSeed = 1025
+
 
 def set_torch_seed(seed=0):
     random.seed(seed)
@@ -63,6 +80,39 @@ def process_annotation_file(lines):
     return entity_dict
 
 
+def find_line_ends(article):
+    """
+    一次找出所有換行位置
+
+    output : 換行符號的 index list
+    """
+    line_ends = []
+    pos = article.find("\n")
+    while pos != -1:
+        line_ends.append(pos)
+        pos = article.find("\n", pos + 1)
+    return line_ends
+
+
+def match_annotation_starts(article, annos):
+    """
+    依序比對標註起點 (與逐字掃描的行為一致)
+    起點不遞增、超出文章、或落在空行換行符上的標註會使後續標註全部失效
+
+    output : 成功比對的標註 list (st_idx 嚴格遞增)
+    """
+    matched, cursor = [], 0
+    for anno in annos:
+        st_idx = anno["st_idx"]
+        if st_idx < cursor or st_idx >= len(article):
+            break
+        if article[st_idx] == "\n" and (st_idx == 0 or article[st_idx - 1] == "\n"):
+            break
+        matched.append(anno)
+        cursor = st_idx + 1
+    return matched
+
+
 def process_medical_report(txt_name, medical_report_folder, annos_dict, special_tokens_dict):
     """
     處理單個病理報告
@@ -73,43 +123,112 @@ def process_medical_report(txt_name, medical_report_folder, annos_dict, special_
     sents = read_file(os.path.join(medical_report_folder, file_name))
     article = "".join(sents)
 
-    bounary, item_idx, temp_seq, seq_pairs = 0, 0, "", []
-    new_line_idx = 0
-    for w_idx, word in enumerate(article):
-        if word == "\n":
-            new_line_idx = w_idx + 1
-            if article[bounary:new_line_idx] == "\n":
-                bounary = new_line_idx
-                continue
-            if temp_seq == "":
-                temp_seq = PHINull
-            sentence = article[bounary:new_line_idx].strip().replace("\t", " ")
-            temp_seq = temp_seq.strip("++")
-            seq_pair = f"{txt_name}\t{bounary}\t{sentence}\t{temp_seq}\n"
-            bounary = new_line_idx
-            seq_pairs.append(seq_pair)
-            temp_seq = ""
-        if w_idx == annos_dict[txt_name][item_idx]["st_idx"]:
-            phi_key = annos_dict[txt_name][item_idx]["phi"]
-            phi_value = annos_dict[txt_name][item_idx]["entity"]
-            # if "normalize_time" in annos_dict[txt_name][item_idx]:
-            #     temp_seq += f"{phi_key}:{phi_value}=>{annos_dict[txt_name][item_idx]['normalize_time']}++
-            # else:
-            temp_seq += f"{phi_key}:{phi_value}++"
-            if item_idx == len(annos_dict[txt_name]) - 1:
-                continue
-            item_idx += 1
+    annos = match_annotation_starts(article, annos_dict.get(txt_name, []))
+    starts = [anno["st_idx"] for anno in annos]
+
+    bounary, item_idx, seq_pairs = 0, 0, []
+    for line_end in find_line_ends(article):
+        if line_end == bounary:
+            bounary = line_end + 1
+            continue
+        # 起點落在本行換行符號之前的標註 (含前面空行) 都屬於本行
+        next_idx = bisect.bisect_left(starts, line_end, item_idx)
+        temp_seq = "".join(
+            f"{anno['phi']}:{anno['entity']}++" for anno in annos[item_idx:next_idx]
+        )
+        item_idx = next_idx
+        if temp_seq == "":
+            temp_seq = PHINull
+        sentence = article[bounary : line_end + 1].strip().replace("\t", " ")
+        temp_seq = temp_seq.strip("++")
+        seq_pairs.append(f"{txt_name}\t{bounary}\t{sentence}\t{temp_seq}\n")
+        bounary = line_end + 1
     return seq_pairs
 
 
+class OrderedSamples:
+    """
+    保持插入順序的樣本集合
+    以 set 記錄已加入的樣本, 使重複檢查為 O(1)
+    """
+
+    def __init__(self, samples=()):
+        self.samples = []
+        self.seen = set()
+        self.extend(samples)
+
+    def append(self, sample):
+        self.samples.append(sample)
+        self.seen.add(sample)
+
+    def extend(self, samples):
+        for sample in samples:
+            self.append(sample)
+
+    def add(self, sample):
+        """只加入尚未出現的樣本, 回傳是否有加入"""
+        if sample in self.seen:
+            return False
+        self.append(sample)
+        return True
+
+    def __contains__(self, sample):
+        return sample in self.seen
+
+    def __iter__(self):
+        return iter(self.samples)
+
+    def __len__(self):
+        return len(self.samples)
+
+
+def find_occurrences(text, pattern):
+    """
+    找出 pattern 在 text 中所有出現位置 (可重疊)
+    """
+    positions = []
+    pos = text.find(pattern)
+    while pos != -1:
+        positions.append(pos)
+        pos = text.find(pattern, pos + 1)
+    return positions
+
+
+def label_windows(content, label_content, num_windows, max_len, stride):
+    """
+    找出完整包含 label 內容的窗口
+
+    output : 窗口 index set
+    """
+    if not label_content:
+        return set(range(num_windows))
+    windows = set()
+    for pos in find_occurrences(content, label_content):
+        # 窗口 k 的範圍為 [k*stride, k*stride+max_len)
+        first = max(0, -(-(pos + len(label_content) - max_len) // stride))
+        last = min(pos // stride, num_windows - 1)
+        windows.update(range(first, last + 1))
+    return windows
+
+
 def sliding_window(fid, start_pos, content, label, max_len=128, overlap=50):
     """
     切分長句
     """
-    splited_pairs = []
+    splited_pairs = OrderedSamples()
     stride = max_len - overlap
-    label_infos = DataF.extract_label_info(label)
-    for i in range(0, len(content), stride):
+    window_starts = range(0, len(content), stride)
+    label_infos = DataF.extract_label_info(label) if label != PHINull else []
+
+    # 每個 label 內容只搜尋一次, 再依位置對應到窗口
+    windows_by_content = {}
+    for _, label_content, _ in label_infos:
+        if label_content not in windows_by_content:
+            windows_by_content[label_content] = label_windows(
+                content, label_content, len(window_starts), max_len, stride
+            )
+
+    for w_idx, i in enumerate(window_starts):
         window = content[i : i + max_len]
         window_start_pos = int(start_pos) + i
         window_label = ""
@@ -117,25 +236,22 @@ def sliding_window(fid, start_pos, content, label, max_len=128, overlap=50):
         if label == PHINull:
             window_label = PHINull
         else:
-            for label_info in label_infos:
-                category, label_content, label_norm = label_info
+            for category, label_content, label_norm in label_infos:
                 # 如果窗口中包含了这个label的内容，则将其加入到label中
-                if label_content in window:
-                    label_content += label_norm if label_norm else ""
-                    window_label += f"{category}:{label_content}++"
+                if w_idx in windows_by_content[label_content]:
+                    window_label += f"{category}:{label_content}{label_norm}++"
         # 删除最后一个换行符
         window_label = window_label[:-2] if window_label != PHINull else window_label
         if not window_label:
             window_label = PHINull
 
         splited_line = f"{fid}\t{window_start_pos}\t{window}\t{window_label}\n"
-        if splited_line not in splited_pairs:
-            splited_pairs.append(splited_line)
+        splited_pairs.add(splited_line)
 
         """sample enhancement"""
-        splited_pairs += small_sample_enhancement(fid, window_start_pos, window, window_label)
+        splited_pairs.extend(small_sample_enhancement(fid, window_start_pos, window, window_label))
 
-    return splited_pairs
+    return splited_pairs.samples
 
 
 def small_sample_enhancement(file_id, start_pos, current_content, current_label):
@@ -174,14 +290,66 @@ def small_sample_enhancement(file_id, start_pos, current_content, current_label)
                 file_id, start_pos, current_content, current_label, num_samples=50
             )
 
-    return list(set(enhanced_samples))
+    return list(dict.fromkeys(enhanced_samples))
+
+
+def splice_short_sentences(parsed_lines, max_length, concatenated_data):
+    """
+    拼接短句 (two pointers)
+    parsed_lines 為依起點排序的 (file_id, start_pos, content, label)
+    每個短句向後拼接, 直到拼接後長度 (含行間空白) 不小於 max_length
+    """
+    starts = [int(start_pos) for _, start_pos, _, _ in parsed_lines]
+    ends = [start + len(content) for start, (_, _, content, _) in zip(starts, parsed_lines)]
+    last = 0
+    for i, (current_file_id, current_start_pos, current_content, current_label) in enumerate(parsed_lines):
+        if len(current_content) > max_length:
+            continue
+        # 結尾位置遞增, 所以可拼接的最後一句只會往後移
+        last = max(last, i)
+        while last + 1 < len(parsed_lines) and ends[last + 1] - starts[i] < max_length:
+            last += 1
+        if last == i:
+            continue
+
+        pieces, labels_list = [current_content], [current_label]
+        current_position = ends[i]
+        for j in range(i + 1, min(last + 2, len(parsed_lines))):
+            if starts[j] < current_position:
+                print("[ERROR]indexs inversion")
+            pieces.append(" " * (starts[j] - current_position))
+            current_position = max(current_position, starts[j])
+            if j > last:
+                # 無法拼接的下一句: 只保留到它起點為止的空白
+                break
+            _, _, next_content, next_label = parsed_lines[j]
+            pieces.append(next_content)
+            current_position += len(next_content)
+            if next_label != PHINull:
+                labels_list.append(next_label)
+
+        # label concatnation
+        if len(set(labels_list)) == 1 and PHINull in labels_list:
+            final_label = PHINull
+        else:
+            final_label = "++".join(filter(lambda x: x != PHINull, labels_list))
+
+        content = "".join(pieces)
+        seq_pair = f"{current_file_id}\t{current_start_pos}\t{content}\t{final_label}\n"
+        if concatenated_data.add(seq_pair):
+            enhenced_pairs = small_sample_enhancement(
+                current_file_id, current_start_pos, content, final_label
+                )
+            if enhenced_pairs:
+                concatenated_data.extend(enhenced_pairs)
 
 
 def concatenate_and_slice_sentences(lines, max_length=256, data_type = "original"):
     """
     拼接短句，切分長句
     """
-    concatenated_data = []
+    concatenated_data = OrderedSamples()
+    parsed_lines = []
     for i in range(len(lines)):
         if lines[i].isspace():
             continue
@@ -197,55 +365,22 @@ def concatenate_and_slice_sentences(lines, max_length=256, data_type = "original
                 max_len=MaxLen*2,
                 overlap=30,
             )
-            concatenated_data += splited_pairs 
+            concatenated_data.extend(splited_pairs)
                  
         
         """add priginal sentences"""
         if data_type == "original":
             concatenated_data.append(lines[i])
-            concatenated_data += small_sample_enhancement(current_file_id, current_start_pos, current_content, current_label)
+            concatenated_data.extend(small_sample_enhancement(current_file_id, current_start_pos, current_content, current_label))
 
         """short sentences processing"""
-        if data_type == "spliced" and len(current_content) <= max_length:
-            labels_list = [current_label]
-            j = i + 1
-            flag = 0
-            while j < len(lines):
-                if lines[j].isspace():
-                    continue
-                next_file_id, next_start_pos, next_content, next_label = lines[j].strip().split("\t")
-                current_position = int(current_start_pos) + len(current_content)
-                if int(next_start_pos) < current_position:
-                    print("[ERROR]indexs inversion")
-                while int(next_start_pos) > current_position:
-                    current_content += " "
-                    current_position += 1
-                new_content = current_content + next_content
-                if len(new_content) < max_length:
-                    current_content = new_content
-                    flag = 1
-                    if next_label != PHINull:
-                        labels_list.append(next_label)
-                else:
-                    break
-                j += 1
-            # label concatnation
-            if len(set(labels_list)) == 1 and PHINull in labels_list:
-                final_label = PHINull
-            else:
-                final_label = "++".join(filter(lambda x: x != PHINull, labels_list))
-
-            seq_pair = f"{current_file_id}\t{current_start_pos}\t{current_content}\t{final_label}\n"
-            if flag and seq_pair not in concatenated_data:
-                concatenated_data.append(seq_pair)
-                enhenced_pairs = small_sample_enhancement(
-                    current_file_id, current_start_pos, current_content, final_label
-                    )
-                if enhenced_pairs:
-                    concatenated_data.extend(enhenced_pairs)
-        
+        if data_type == "spliced":
+            parsed_lines.append((current_file_id, current_start_pos, current_content, current_label))
 
-    return concatenated_data
+    if data_type == "spliced":
+        splice_short_sentences(parsed_lines, max_length, concatenated_data)
+
+    return concatenated_data.samples
 
 
 def append_length(line):
@@ -357,79 +492,128 @@ def process_valid_data(test_txts, out_file):
                     fw_slc.write(f"{fid}\t{position}\t{sent_slc}\n") 
 
 
-def generate_annotated_medical_report_parallel(
-    anno_file_path, medical_report_folder, tsv_output_path, dtype, sample, num_processes=4
-):
+def process_report_task(task):
     """
-    呼叫上面的兩個function
-    處理全部的病理報告和標記檔案
+    worker: 處理單個病理報告, 並對每個 dtype 切分/拼接
+    每個 dtype 前以 seed 與 file id 重設亂數, 使資料增強結果與 worker 數量及同時生成的 dtype 無關
+
+    output : {dtype: 單個報告的 sequence pairs}
+    """
+    txt_name, medical_report_folder, annos, dtypes, random_seed = task
+    result_pairs = process_medical_report(
+        txt_name, medical_report_folder, {txt_name: annos}, special_tokens_dict
+    )
+    views = {}
+    for dtype in dtypes:
+        random.seed(f"{random_seed}-{txt_name}")
+        views[dtype] = concatenate_and_slice_sentences(result_pairs, MaxLen, dtype)
+    return views
+
+
+def process_reports(file_ids, medical_report_folder, annos_dict, writers, num_processes=4):
+    """
+    將報告分配給多個 process 處理, 結果依 file_ids 順序寫入各 dtype 的檔案
 
-    output : 全部的 sequence pairs
+    output : {dtype: 最長的 sequence pair 長度}
+    """
+    dtypes = list(writers.keys())
+    tasks = [
+        (txt_name, medical_report_folder, annos_dict[txt_name], dtypes, RandomSeed)
+        for txt_name in file_ids
+    ]
+    max_lengths = {dtype: 0 for dtype in dtypes}
+
+    def write_views(views):
+        for dtype, concatenated_pairs in views.items():
+            for seq_pair in concatenated_pairs:
+                writers[dtype].write(seq_pair)
+                max_lengths[dtype] = max(max_lengths[dtype], len(seq_pair))
+
+    if num_processes <= 1:
+        for task in tasks:
+            write_views(process_report_task(task))
+        return max_lengths
+
+    chunksize = max(1, len(tasks) // (num_processes * 4))
+    with ProcessPoolExecutor(max_workers=num_processes) as executor:
+        for views in executor.map(process_report_task, tasks, chunksize=chunksize):
+            write_views(views)
+    return max_lengths
+
+
+def write_split(file_ids, medical_report_folder, annos_dict, file_names, num_processes=4):
+    """
+    處理一個 split (train/test) 的報告, 每個 dtype 寫入各自的 tsv
+
+    output : {dtype: 最長的 sequence pair 長度}
+    """
+    writers = {dtype: open(file_name, "w", encoding="utf-8") for dtype, file_name in file_names.items()}
+    try:
+        return process_reports(file_ids, medical_report_folder, annos_dict, writers, num_processes)
+    finally:
+        for fw in writers.values():
+            fw.close()
+
+
+def generate_annotated_medical_report_views(
+    anno_file_path, medical_report_folder, tsv_output_paths, sample, num_processes=4
+):
+    """
+    標記檔案與病理報告只讀取/解析一次, 同時生成多個 dtype (original/sliced/spliced)
+    tsv_output_paths : {dtype: tsv 路徑}, 各自輸出 _train.tsv 與 _test.tsv
     """
     anno_lines = read_file(anno_file_path)
     annos_dict = process_annotation_file(anno_lines)
     txt_names = list(annos_dict.keys())
     
     # rename savename
-    train_file_name = tsv_output_path.replace(".tsv", "_train.tsv")
-    test_file_name = tsv_output_path.replace(".tsv", "_test.tsv")
+    train_file_names = {
+        dtype: path.replace(".tsv", "_train.tsv") for dtype, path in tsv_output_paths.items()
+    }
+    test_file_names = {
+        dtype: path.replace(".tsv", "_test.tsv") for dtype, path in tsv_output_paths.items()
+    }
       
     # sample test files
-    random_seed = 1025
-    random.seed(random_seed)
+    random.seed(RandomSeed)
     test_file_ids = random.sample(txt_names, int(0.1 * len(txt_names)))
     train_file_ids = [fid for fid in txt_names if fid not in test_file_ids]
 
     """Training data"""
     print("processing each medical file")
-    all_seq_pairs = []
-    for txt_name in train_file_ids:
-        result_pairs = process_medical_report(
-            txt_name, medical_report_folder, annos_dict, special_tokens_dict
-        )
-        concatenated_pairs = concatenate_and_slice_sentences(result_pairs, MaxLen, dtype)
-        all_seq_pairs.extend(concatenated_pairs)
-    
-    print(f"max length in dataset-{dtype} training:", max(len(s) for s in all_seq_pairs))
+    max_lengths = write_split(
+        train_file_ids, medical_report_folder, annos_dict, train_file_names, num_processes
+    )
+    for dtype, max_length in max_lengths.items():
+        print(f"max length in dataset-{dtype} training:", max_length)
     print("All traiing medical file done")
-    with open(train_file_name, "w", encoding="utf-8") as fw:
-        for seq_pair in all_seq_pairs:
-            fw.write(seq_pair)
     print("Training tsv format dataset done")
     
     
     """Testing data"""
-    all_seq_pairs = []
-    for txt_name in test_file_ids:
-        result_pairs = process_medical_report(
-            txt_name, medical_report_folder, annos_dict, special_tokens_dict
-        )
-        concatenated_pairs = concatenate_and_slice_sentences(result_pairs, MaxLen, dtype)
-        all_seq_pairs.extend(concatenated_pairs)
-        
-    print(f"max length in dataset1-{dtype} training:", max(len(s) for s in all_seq_pairs))
+    max_lengths = write_split(
+        test_file_ids, medical_report_folder, annos_dict, test_file_names, num_processes
+    )
+    for dtype, max_length in max_lengths.items():
+        print(f"max length in dataset1-{dtype} training:", max_length)
     print("All testing medical file done")
-    with open(test_file_name, "w", encoding="utf-8") as fw:
-        for seq_pair in all_seq_pairs:
-            fw.write(seq_pair)
     print("Testing tsv format dataset done")
+
+
+def generate_annotated_medical_report_parallel(
+    anno_file_path, medical_report_folder, tsv_output_path, dtype, sample, num_processes=4
+):
+    """
+    呼叫上面的兩個function
+    處理全部的病理報告和標記檔案 (單一 dtype)
+    """
+    generate_annotated_medical_report_views(
+        anno_file_path, medical_report_folder, {dtype: tsv_output_path}, sample, num_processes
+    )
     
 
 if __name__ == "__main__":
 
-    bos = "<|endoftext|>"
-    eos = "<|END|>"
-    pad = "<|pad|>"
-    ner = "\n\n####\n\n"
-    special_tokens_dict = {
-        "bos_token": bos,
-        "eos_token": eos,
-        "pad_token": pad,
-        "sep_token": ner,
-    }
-
-    MaxLen = 128
-    PHINull = "PHI:Null"
     Types = ["original", "sliced", "spliced"]
 
 
@@ -439,26 +623,22 @@ if __name__ == "__main__":
     # report_folder = os.path.join(path, "First_Phase_Text_Dataset")
     # anno_info_path = os.path.join(path, "answer.txt")
     
-    # for dtype in Types:
-    #     sample = True
-    #     file_name = f"train_phase1_v8_{dtype}.tsv"
-    #     save_name = os.path.join(os.getcwd(), f"Data/{file_name}")
-    #     generate_annotated_medical_report_parallel(anno_info_path, report_folder, 
-    #                                                 save_name, dtype, sample, 
-    #                                                 num_processes=4)
-    #     sample = False
+    # save_names = {
+    #     dtype: os.path.join(os.getcwd(), f"Data/train_phase1_v8_{dtype}.tsv") for dtype in Types
+    # }
+    # generate_annotated_medical_report_views(anno_info_path, report_folder, 
+    #                                         save_names, sample=True, 
+    #                                         num_processes=4)
         
     # path = os.path.join(os.getcwd(), "Data/Second_Phase_Dataset")
     # report_folder = os.path.join(path, "Second_Phase_Text_Dataset")
     # anno_info_path = os.path.join(path, "answer.txt")
-    # for dtype in Types:
-    #     sample = True
-    #     file_name =  f"train_phase2_v8_{dtype}.tsv"
-    #     save_name = os.path.join(os.getcwd(), f"Data/{file_name}")
-    #     generate_annotated_medical_report_parallel(anno_info_path, report_folder, 
-    #                                                 save_name, dtype, sample, 
-    #                                                 num_processes=4)
-    #     sample = False
+    # save_names = {
+    #     dtype: os.path.join(os.getcwd(), f"Data/train_phase2_v8_{dtype}.tsv") for dtype in Types
+    # }
+    # generate_annotated_medical_report_views(anno_info_path, report_folder, 
+    #                                         save_names, sample=True, 
+    #                                         num_processes=4)
         
     
     # """validation data processing"""
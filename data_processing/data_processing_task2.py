@@ -10,9 +10,25 @@ import os
 import numpy as np
 import torch
 import random
+from concurrent.futures import ProcessPoolExecutor
 
 import data_forge as DataF
 
+bos = "<|endoftext|>"
+eos = "<|END|>"
+pad = "<|pad|>"
+ner = "\n\n####\n\n"
+special_tokens_dict = {
+    "bos_token": bos,
+    "eos_token": eos,
+    "pad_token": pad,
+    "sep_token": ner,
+}
+
+MaxLen = 128
+PHINull = "PHI:Null"
+
+
 def set_torch_seed(seed=0):
     random.seed(seed)
     np.random.seed(seed)
@@ -144,6 +160,38 @@ def forge_duration_sample(num_samples):
     return duration_samples
         
 
+def process_report_task(task):
+    """
+    worker: 處理單個病理報告
+
+    output : 單個報告的 normalized pairs
+    """
+    txt_name, medical_report_folder, annos = task
+    return process_medical_report(
+        txt_name, medical_report_folder, {txt_name: annos}, special_tokens_dict
+    )
+
+
+def process_reports(file_ids, medical_report_folder, annos_dict, num_processes=4):
+    """
+    將報告分配給多個 process 處理, 結果依 file_ids 順序合併
+
+    output : 全部報告的 normalized pairs
+    """
+    tasks = [(txt_name, medical_report_folder, annos_dict[txt_name]) for txt_name in file_ids]
+    all_seq_pairs = []
+    if num_processes <= 1:
+        for task in tasks:
+            all_seq_pairs.extend(process_report_task(task))
+        return all_seq_pairs
+
+    chunksize = max(1, len(tasks) // (num_processes * 4))
+    with ProcessPoolExecutor(max_workers=num_processes) as executor:
+        for result_pairs in executor.map(process_report_task, tasks, chunksize=chunksize):
+            all_seq_pairs.extend(result_pairs)
+    return all_seq_pairs
+
+
 def generate_annotated_medical_report_parallel(
     anno_file_path, medical_report_folder, tsv_output_path, num_processes=4
 ):
@@ -159,11 +207,7 @@ def generate_annotated_medical_report_parallel(
 
     print("processing each medical file")
 
-    all_seq_pairs = []
-    for txt_name in txt_names:
-        result_pairs = process_medical_report(txt_name, medical_report_folder, 
-                                              annos_dict, special_tokens_dict)
-        all_seq_pairs.extend(result_pairs)
+    all_seq_pairs = process_reports(txt_names, medical_report_folder, annos_dict, num_processes)
     
     all_seq_pairs += forge_duration_sample(300)
     all_seq_pairs += DataF.generate_set_samples(300)
@@ -180,19 +224,6 @@ def generate_annotated_medical_report_parallel(
 
 if __name__ == "__main__":
 
-    bos = "<|endoftext|>"
-    eos = "<|END|>"
-    pad = "<|pad|>"
-    ner = "\n\n####\n\n"
-    special_tokens_dict = {
-        "bos_token": bos,
-        "eos_token": eos,
-        "pad_token": pad,
-        "sep_token": ner,
-    }
-
-    MaxLen = 128
-    PHINull = "PHI:Null"
     NormCat = ["TIME", "SET", "DATE", "DURATION"]
 
 
@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Streaming error report writer (tsv / parquet / xlsx)
+
+@author: huangpaveen
+"""
+
+import os
+
+ReportFormats = ["tsv", "parquet", "xlsx"]
+
+
+class ErrorReportWriter:
+    """
+    write FP/FN/TP rows as they are produced by the evaluation loop
+    tsv is written line by line, parquet in row groups; pyarrow / pandas + openpyxl
+    are only imported when parquet / xlsx output is requested
+    """
+
+    def __init__(self, path, columns, fmt="tsv", batch_size=10000):
+        if fmt not in ReportFormats:
+            raise ValueError(f"unknown report format: {fmt}")
+        self.path = path
+        self.columns = columns
+        self.fmt = fmt
+        self.batch_size = batch_size
+        self.rows = []
+        self.file = None
+        self.parquet_writer = None
+        if fmt == "tsv":
+            self.file = open(path, "w", encoding="utf-8")
+            self.file.write("\t".join(columns) + "\n")
+
+    def format_row(self, row):
+        row = ["" if value is None else str(value) for value in row]
+        # answer lines without normalization are one column short
+        return row + [""] * (len(self.columns) - len(row))
+
+    def write(self, row):
+        row = self.format_row(row)
+        if self.fmt == "tsv":
+            self.file.write("\t".join(row) + "\n")
+            return
+        self.rows.append(row)
+        if self.fmt == "parquet" and len(self.rows) >= self.batch_size:
+            self.flush_parquet()
+
+    def write_rows(self, rows):
+        for row in rows:
+            self.write(row)
+
+    def flush_parquet(self):
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        table = pa.table({name: [row[i] for row in self.rows] for i, name in enumerate(self.columns)},
+                         schema=pa.schema([(name, pa.string()) for name in self.columns]))
+        if self.parquet_writer is None:
+            self.parquet_writer = pq.ParquetWriter(self.path, table.schema)
+        self.parquet_writer.write_table(table)
+        self.rows = []
+
+    def close(self):
+        if self.fmt == "tsv":
+            self.file.close()
+        elif self.fmt == "parquet":
+            if self.rows or self.parquet_writer is None:
+                self.flush_parquet()
+            self.parquet_writer.close()
+        else:
+            import pandas as pd
+
+            pd.DataFrame(self.rows, columns=self.columns).to_excel(self.path, index=False)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+def report_row(rows, row, writer=None):
+    """
+    send one FP/FN/TP row to its writer, kept in rows only when there is no writer
+    """
+    if writer is None:
+        rows.append(row)
+    else:
+        writer.write(row)
+
+
+def open_reports(path, name, columns_dict, fmt="tsv"):
+    """
+    one writer per report: {report: writer}, saved as {report}_{name}.{fmt}
+    """
+    return {
+        report: ErrorReportWriter(os.path.join(path, f"{report}_{name}.{fmt}"), columns, fmt)
+        for report, columns in columns_dict.items()
+    }
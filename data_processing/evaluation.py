@@ -7,7 +7,11 @@ Created on Tue Nov 14 16:35:43 2023
 """
 
 import os
-import pandas as pd
+import glob
+import error_report as ER
+from concurrent.futures import ProcessPoolExecutor
+import evaluation_core as EC
+import evaluation_cache as CA
 
 def load_data(file_path):
     data = []
@@ -26,143 +30,157 @@ def add_error_info(record, error, tp=None, has_time=True):
         return record + [tp, error]
     return record + ["no time", tp, error]
 
-def evaluate_performance(pred_data, true_data):
-    tp, fp, fn = 0, 0, 0
-    false_positives = []
-    false_negatives = []
-    true_positives = []
-
-    pred_dict = {(d[0], int(d[2]), int(d[3])): d for d in pred_data}
-    true_dict = {(d[0], int(d[2]), int(d[3])): d for d in true_data}
-
-    for key, prediction in pred_dict.items():
-        prediction_type = prediction[1]
+ReportColumns = {
+    "false_positives": ["file_name", "pred_category", "start_pos", "end_pos",
+                        "pred_content", "pred_norm_time", "gt_content", "error"],
+    "false_negatives": ["file_name", "gt_category", "start_pos", "end_pos",
+                        "gt_content", "gt_norm_time", "pred_content", "error"],
+    "true_positives": ["file_name", "pred_category", "start_pos", "end_pos",
+                       "pred_content", "pred_norm_time"],
+}
+
+
+def evaluate_performance(pred_data, true_data, reports=None):
+    """
+    micro P/R/F1 of EC.evaluate_tables with the FP/FN/TP rows of error_reports
+    reports: optional {report: ErrorReportWriter}, FP/FN/TP rows are written as they are found
+             and the returned list of a report with a writer stays empty
+    """
+    vocab = EC.Vocabulary()
+    results = EC.evaluate_tables(EC.AnswerTable.from_rows(pred_data, vocab),
+                                 EC.AnswerTable.from_rows(true_data, vocab), with_rows=True)
+    false_positives, false_negatives, true_positives = error_reports(pred_data, true_data, results["rows"], reports)
+    return results["precision"], results["recall"], results["f1"], false_positives, false_negatives, true_positives
+
+
+def error_reports(pred_data, true_data, rows, reports=None):
+    """
+    the FP/FN/TP rows of evaluate_performance, built from the joined rows of
+    EC.evaluate_tables(..., with_rows=True)["rows"] on the same pred_data / true_data
+    """
+    reports = reports or {}
+    false_positives, false_negatives, true_positives = [], [], []
+    for pred_row, true_row in zip(rows["pred"].tolist(), rows["pred_match"].tolist()):
+        prediction = pred_data[pred_row]
         has_time = len(prediction) == 6
-
-        if key not in true_dict:
-            fp += 1
-            false_positives.append(add_error_info(prediction, "not in answer", None, has_time))
+        if true_row < 0:
+            ER.report_row(false_positives, add_error_info(prediction, "not in answer", None, has_time),
+                          reports.get("false_positives"))
+        elif prediction[1] != true_data[true_row][1]:
+            ER.report_row(false_positives, add_error_info(prediction, "type wrong", true_data[true_row][1], has_time),
+                          reports.get("false_positives"))
         else:
-            true_type = true_dict[key][1]
-            if prediction_type != true_type:
-                fp += 1
-                false_positives.append(add_error_info(prediction, "type wrong", true_type, has_time))
-            else:
-                tp += 1
-                true_positives.append(prediction)
-
-    for key, answer in true_dict.items():
-        answer_type = answer[1]
+            ER.report_row(true_positives, prediction, reports.get("true_positives"))
+
+    for true_row, pred_row in zip(rows["true"].tolist(), rows["true_match"].tolist()):
+        answer = true_data[true_row]
         has_time = len(answer) == 6
+        if pred_row < 0:
+            ER.report_row(false_negatives, add_error_info(answer, "not predicted", None, has_time),
+                          reports.get("false_negatives"))
+        elif pred_data[pred_row][1] != answer[1]:
+            ER.report_row(false_negatives, add_error_info(answer, "type wrong", pred_data[pred_row][1], has_time),
+                          reports.get("false_negatives"))
+    return false_positives, false_negatives, true_positives
 
-        if key not in pred_dict:
-            fn += 1
-            false_negatives.append(add_error_info(answer, "not predicted", None, has_time))
-        else:
-            prediction_type = pred_dict[key][1]
-            if prediction_type != answer_type:
-                false_negatives.append(add_error_info(answer, "type wrong", prediction_type, has_time))
 
-    precision = tp / (tp + fp) if tp + fp > 0 else 0
-    recall = tp / (tp + fn) if tp + fn > 0 else 0
-    f1 = 2 * (precision * recall) / (precision + recall) if precision + recall > 0 else 0
-    
-    return precision, recall, f1, false_positives, false_negatives, true_positives
+def evaluate_macro_f1(pred_data, true_data):
+    """
+    per-category F1 (a wrong type counts as FP and FN) and their mean, from EC.evaluate_tables
+    """
+    vocab = EC.Vocabulary()
+    results = EC.evaluate_tables(EC.AnswerTable.from_rows(pred_data, vocab), EC.AnswerTable.from_rows(true_data, vocab))
+    return results["macro_f1"], results["category_f1"]
 
 
-def evaluate_macro_f1(pred_data, true_data):
-    def add_error_info(data, error_type, mismatch_type=None, has_time=False):
-        return data + [error_type, mismatch_type] if has_time else data + [error_type, mismatch_type, None]
+def print_results(file_path, false_positives, false_negatives):
+    with open(file_path, 'w', encoding='utf-8') as file:
+        file.write("False Positives:\n")
+        for item in false_positives:
+            file.write(str(item) + '\n')
+        file.write("\nFalse Negatives:\n")
+        for item in false_negatives:
+            file.write(str(item) + '\n')
 
-    # Initialize counters for each category
-    category_stats = {}
 
-    # Convert data to dictionaries for easier access
-    pred_dict = {(d[0], int(d[2]), int(d[3])): d for d in pred_data}
-    true_dict = {(d[0], int(d[2]), int(d[3])): d for d in true_data}
+"""Batch evaluation"""
+BatchGold = {}
 
-    # Process predictions
-    for key, prediction in pred_dict.items():
-        prediction_type = prediction[1]
 
-        # Initialize stats for new category
-        if prediction_type not in category_stats:
-            category_stats[prediction_type] = {"tp": 0, "fp": 0, "fn": 0}
+def init_batch_worker(gold_table, gold_path=None, cache_dir=None):
+    BatchGold["table"] = gold_table
+    BatchGold["path"] = gold_path
+    BatchGold["cache"] = CA.ResultsCache(cache_dir) if cache_dir else None
 
-        if key not in true_dict:
-            category_stats[prediction_type]["fp"] += 1
-        else:
-            true_type = true_dict[key][1]
-            if prediction_type != true_type:
-                category_stats[prediction_type]["fp"] += 1
-            else:
-                category_stats[prediction_type]["tp"] += 1
-
-    # Process true values for false negatives
-    for key, answer in true_dict.items():
-        answer_type = answer[1]
-
-        # Initialize stats for new category
-        if answer_type not in category_stats:
-            category_stats[answer_type] = {"tp": 0, "fp": 0, "fn": 0}
-
-        if key not in pred_dict:
-            category_stats[answer_type]["fn"] += 1
-        else:
-            prediction_type = pred_dict[key][1]
-            if prediction_type != answer_type:
-                category_stats[answer_type]["fn"] += 1
 
-    # Calculate F1 score for each category
-    category_f1_scores = {}
-    for category, stats in category_stats.items():
-        tp, fp, fn = stats["tp"], stats["fp"], stats["fn"]
-        precision = tp / (tp + fp) if tp + fp > 0 else 0
-        recall = tp / (tp + fn) if tp + fn > 0 else 0
-        f1 = 2 * (precision * recall) / (precision + recall) if precision + recall > 0 else 0
-        category_f1_scores[category] = f1
+def evaluate_answer_file(pred_path):
+    if BatchGold["cache"]:
+        return os.path.basename(pred_path), BatchGold["cache"].evaluate(pred_path, BatchGold["path"])
+    gold_table = BatchGold["table"]
+    pred_table = EC.AnswerTable.load(pred_path, gold_table.vocab)
+    return os.path.basename(pred_path), EC.evaluate_tables(pred_table, gold_table)
 
-    # Calculate macro-F1 score
-    macro_f1 = sum(category_f1_scores.values()) / len(category_f1_scores) if category_f1_scores else 0
 
-    return macro_f1, category_f1_scores
+def evaluate_directory(answer_dir, gold_path, summary_path, pattern="answer_*.txt", num_processes=4,
+                       cache_dir=None):
+    """
+    score every answer file of a folder against the gold answers, loaded and indexed once,
+    and write one summary table (micro/macro F1 and per-category F1 columns)
+    cache_dir: reuse the counts of unchanged answer files / file ids (evaluation_cache)
+    """
+    gold_table = EC.AnswerTable.load(gold_path, EC.Vocabulary())
+    pred_paths = sorted(
+        path for path in glob.glob(os.path.join(answer_dir, pattern))
+        if os.path.abspath(path) != os.path.abspath(gold_path)
+    )
 
+    if num_processes <= 1:
+        init_batch_worker(gold_table, gold_path, cache_dir)
+        summary = [evaluate_answer_file(path) for path in pred_paths]
+    else:
+        with ProcessPoolExecutor(num_processes, initializer=init_batch_worker, initargs=(gold_table, gold_path, cache_dir)) as executor:
+            summary = list(executor.map(evaluate_answer_file, pred_paths))
+
+    categories = sorted(set(cat for _, results in summary for cat in results["category_f1"]))
+    with open(summary_path, "w", encoding="utf-8") as file:
+        file.write("\t".join(["file_name", "precision", "recall", "f1", "macro_f1", "norm_f1"] + categories) + "\n")
+        for name, results in summary:
+            row = [name] + [f"{results[k]:.4f}" for k in ["precision", "recall", "f1", "macro_f1"]]
+            row.append(f"{results['norm']['f1']:.4f}")
+            row += [f"{results['category_f1'][cat]:.4f}" if cat in results["category_f1"] else "" for cat in categories]
+            file.write("\t".join(row) + "\n")
+    return summary
 
-def print_results(file_path, false_positives, false_negatives):
-    with open(file_path, 'w', encoding='utf-8') as file:
-        file.write("False Positives:\n")
-        for item in false_positives:
-            file.write(str(item) + '\n')
-        file.write("\nFalse Negatives:\n")
-        for item in false_negatives:
-            file.write(str(item) + '\n')
-        
 
 if __name__ == "__main__":
     # Load the generated answers and the standard answers
     path = os.path.join(os.getcwd(), "Result/val")
-    time = "1701181213_1701317300"
-    pred_data = load_data(os.path.join(path, f"answer_{time}.txt"))
-    true_data = load_data(os.path.join(path, "answer_val_phase1.txt"))
-
-
-    # Evaluation 1
-    precision, recall, f1, fp, fn, tp = evaluate_performance(pred_data, true_data)
-    print(f"Precision: {precision}, Recall: {recall}, F1-Measure: {f1}")
-    
-    macro_f1, category_f1_scores = evaluate_macro_f1(pred_data, true_data)
-    print(f"macro f1: {macro_f1}")
-    
-    # 转换列表为 DataFrame
-    fp_df = pd.DataFrame(fp, columns=["file_name", "pred_category", "start_pos", "end_pos", 
-                                      "pred_content", "pred_norm_time", "gt_content", "error"])
-    fn_df = pd.DataFrame(fn, columns=["file_name", "gt_category", "start_pos", "end_pos", 
-                                      "gt_content", "gt_norm_time", "pred_content", "error"])
-    tp_df = pd.DataFrame(tp, columns=["file_name", "pred_category", "start_pos", "end_pos", 
-                                      "pred_content"])
-    
+    batch = False
+    if batch:
+        # compare all checkpoints and ensembles in the folder in one run
+        summary = evaluate_directory(path, os.path.join(path, "answer_val_phase1.txt"),
+                                     os.path.join(path, "summary.tsv"),
+                                     cache_dir=os.path.join(path, "eval_cache"))
+        for name, results in sorted(summary, key=lambda x: x[1]["f1"], reverse=True):
+            print(f"{name}: F1-Measure {results['f1']:.4f}, macro f1 {results['macro_f1']:.4f}")
+    else:
+        time = "1701181213_1701317300"
+        pred_data = load_data(os.path.join(path, f"answer_{time}.txt"))
+        true_data = load_data(os.path.join(path, "answer_val_phase1.txt"))
+
+
+        # Evaluation 1
+        vocab = EC.Vocabulary()
+        results = EC.evaluate_tables(EC.AnswerTable.from_rows(pred_data, vocab),
+                                     EC.AnswerTable.from_rows(true_data, vocab), with_rows=True)
+        print(f"Precision: {results['precision']}, Recall: {results['recall']}, F1-Measure: {results['f1']}")
+        print(f"macro f1: {results['macro_f1']}")
     
-    fp_df.to_excel(os.path.join(path, f'false_positives_{time}.xlsx'), index=False)
-    fn_df.to_excel(os.path.join(path, f'false_negatives_{time}.xlsx'),index=False)
-    tp_df.to_excel(os.path.join(path, f'true_positives_{time}.xlsx'),index=False)
-                                
+        # error analysis: "xlsx" loads pandas/openpyxl, "tsv" and "parquet" are streamed
+        report_format = "tsv"
+        reports = ER.open_reports(path, time, ReportColumns, report_format)
+        try:
+            error_reports(pred_data, true_data, results["rows"], reports)
+        finally:
+            for writer in reports.values():
+                writer.close()
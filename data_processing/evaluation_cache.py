@@ -0,0 +1,119 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+On-disk cache of evaluation counts, keyed by the content hashes of the answer files
+
+@author: huangpaveen
+"""
+
+import io
+import os
+import json
+import hashlib
+
+import evaluation_core as EC
+
+
+def content_hash(data):
+    return hashlib.sha1(data).hexdigest()
+
+
+def read_answer_lines(file_path):
+    """
+    output : file hash, {fid: answer lines in file order}, {fid: hash of its lines}
+    """
+    with open(file_path, "rb") as file:
+        data = file.read()
+    return parse_answer_lines(data)
+
+
+def parse_answer_lines(data):
+    lines_by_fid = {}
+    for line in io.StringIO(data.decode("utf-8"), newline=None):
+        parts = line.strip().split("\t")
+        if len(parts) < 5:  # Skip incomplete lines
+            continue
+        lines_by_fid.setdefault(parts[0], []).append(parts)
+    fid_hashes = {
+        fid: content_hash("\n".join("\t".join(parts) for parts in rows).encode("utf-8"))
+        for fid, rows in lines_by_fid.items()
+    }
+    return content_hash(data), lines_by_fid, fid_hashes
+
+
+class ResultsCache:
+    """
+    one json per prediction file with its per-fid counts (EC.counts_by_fid)
+    unchanged files return the cached results, otherwise only the fids whose
+    prediction or gold lines changed are evaluated again
+    """
+
+    def __init__(self, cache_dir):
+        self.cache_dir = cache_dir
+        os.makedirs(cache_dir, exist_ok=True)
+        self.gold = {}
+
+    def cache_path(self, pred_path):
+        return os.path.join(self.cache_dir, content_hash(os.path.abspath(pred_path).encode("utf-8")) + ".json")
+
+    def load_entry(self, pred_path):
+        path = self.cache_path(pred_path)
+        if not os.path.exists(path):
+            return None
+        with open(path, "r", encoding="utf-8") as file:
+            return json.load(file)
+
+    def save_entry(self, pred_path, entry):
+        path = self.cache_path(pred_path)
+        with open(path + ".tmp", "w", encoding="utf-8") as file:
+            json.dump(entry, file, ensure_ascii=False)
+        os.replace(path + ".tmp", path)
+
+    def load_gold(self, gold_path):
+        # gold file hashed on every call, its lines parsed again only when the hash changed
+        key = os.path.abspath(gold_path)
+        with open(gold_path, "rb") as file:
+            data = file.read()
+        if key not in self.gold or self.gold[key][0] != content_hash(data):
+            self.gold[key] = parse_answer_lines(data)
+        return self.gold[key]
+
+    def evaluate(self, pred_path, gold_path, norm_categories=EC.NormCategories):
+        """
+        same results as EC.evaluate_files
+        """
+        norm_categories = list(norm_categories or [])
+        gold_hash, gold_lines, gold_fid_hashes = self.load_gold(gold_path)
+        entry = self.load_entry(pred_path)
+        if entry and entry["norm_categories"] != norm_categories:
+            entry = None
+
+        with open(pred_path, "rb") as file:
+            pred_hash = content_hash(file.read())
+        if entry and entry["pred_hash"] == pred_hash and entry["gold_hash"] == gold_hash:
+            counts = {fid: cached["counts"] for fid, cached in entry["fids"].items()}
+            return EC.results_from_counts(counts, bool(norm_categories))
+
+        _, pred_lines, pred_fid_hashes = read_answer_lines(pred_path)
+        cached = entry["fids"] if entry else {}
+        fids = set(pred_lines) | set(gold_lines)
+        fid_hashes = {fid: [pred_fid_hashes.get(fid), gold_fid_hashes.get(fid)] for fid in fids}
+        counts = {fid: cached[fid]["counts"] for fid in fids
+                  if fid in cached and cached[fid]["hashes"] == fid_hashes[fid]}
+
+        changed = [fid for fid in sorted(fids) if fid not in counts]
+        if changed:
+            vocab = EC.Vocabulary()
+            true = EC.AnswerTable.from_rows([parts for fid in changed for parts in gold_lines.get(fid, [])], vocab)
+            pred = EC.AnswerTable.from_rows([parts for fid in changed for parts in pred_lines.get(fid, [])], vocab)
+            new_counts = EC.counts_by_fid(pred, true, norm_categories)
+            for fid in changed:
+                counts[fid] = new_counts.get(fid, {"micro": [0, 0, 0], "category": {}, "norm": [0, 0, 0]})
+
+        self.save_entry(pred_path, {
+            "pred_hash": pred_hash,
+            "gold_hash": gold_hash,
+            "norm_categories": norm_categories,
+            "fids": {fid: {"hashes": fid_hashes[fid], "counts": counts[fid]} for fid in fids},
+        })
+        return EC.results_from_counts(counts, bool(norm_categories))
@@ -0,0 +1,407 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Columnar evaluation core: micro/macro F1 and normalization scores in one joined pass
+
+@author: huangpaveen
+"""
+
+import numpy as np
+
+NormCategories = ["TIME", "DURATION", "SET", "DATE"]
+
+
+class Vocabulary:
+    """
+    intern strings (file ids, categories, normalizations) to integer codes
+    """
+
+    def __init__(self):
+        self.codes = {}
+        self.strings = []
+
+    def encode(self, string):
+        code = self.codes.get(string)
+        if code is None:
+            code = len(self.strings)
+            self.codes[string] = code
+            self.strings.append(string)
+        return code
+
+    def decode(self, code):
+        return self.strings[code]
+
+
+class AnswerTable:
+    """
+    answer file as columns: fid / category / normalization codes and int32 offsets
+    norm is -1 when the line has no normalization
+    """
+
+    def __init__(self, fids, categories, starts, ends, norms, vocab):
+        self.fid = np.asarray(fids, dtype=np.int32)
+        self.category = np.asarray(categories, dtype=np.int32)
+        self.start = np.asarray(starts, dtype=np.int32)
+        self.end = np.asarray(ends, dtype=np.int32)
+        self.norm = np.asarray(norms, dtype=np.int32)
+        self.vocab = vocab
+
+    def __len__(self):
+        return len(self.fid)
+
+    @classmethod
+    def from_rows(cls, rows, vocab):
+        """
+        rows: split answer lines as returned by evaluation.load_data
+        """
+        fids, categories, starts, ends, norms = [], [], [], [], []
+        for parts in rows:
+            fids.append(vocab.encode(parts[0]))
+            categories.append(vocab.encode(parts[1]))
+            starts.append(int(parts[2]))
+            ends.append(int(parts[3]))
+            norms.append(vocab.encode(parts[5]) if len(parts) > 5 else -1)
+        return cls(fids, categories, starts, ends, norms, vocab)
+
+    @classmethod
+    def load(cls, file_path, vocab):
+        rows = []
+        with open(file_path, "r", encoding="utf-8") as file:
+            for line in file:
+                parts = line.strip().split("\t")
+                if len(parts) < 5:  # Skip incomplete lines
+                    continue
+                rows.append(parts)
+        return cls.from_rows(rows, vocab)
+
+    def select(self, mask):
+        return AnswerTable(
+            self.fid[mask], self.category[mask], self.start[mask], self.end[mask], self.norm[mask], self.vocab
+        )
+
+
+def dense_ids(*columns):
+    """
+    one integer id per distinct row of the given columns
+    """
+    if len(columns[0]) == 0:
+        return np.zeros(0, dtype=np.int64)
+    _, inverse = np.unique(np.stack(columns, axis=1), axis=0, return_inverse=True)
+    return inverse.reshape(-1)
+
+
+def last_unique(keys):
+    """
+    row index of the last occurrence of every key (later lines overwrite earlier ones)
+    """
+    reversed_keys = keys[::-1]
+    _, first_in_reversed = np.unique(reversed_keys, return_index=True)
+    return np.sort(len(keys) - 1 - first_in_reversed)
+
+
+def dict_rows(keys):
+    """
+    rows a {key: row} dict of the lines holds: the last row of every key, in order of its first occurrence
+    """
+    if len(keys) == 0:
+        return np.zeros(0, dtype=np.int64)
+    _, first = np.unique(keys, return_index=True)
+    _, first_in_reversed = np.unique(keys[::-1], return_index=True)
+    return (len(keys) - 1 - first_in_reversed)[np.argsort(first, kind="stable")]
+
+
+def lookup(keys, target_keys):
+    """
+    for every key, the last row of target_keys with the same key, -1 when missing
+    """
+    rows = last_unique(target_keys)
+    if len(rows) == 0:
+        return np.full(len(keys), -1, dtype=np.int64)
+    order = np.argsort(target_keys[rows], kind="stable")
+    sorted_keys, sorted_rows = target_keys[rows][order], rows[order]
+    found = np.minimum(np.searchsorted(sorted_keys, keys), len(sorted_keys) - 1)
+    return np.where(sorted_keys[found] == keys, sorted_rows[found], -1)
+
+
+def join(pred_keys, true_keys):
+    """
+    deduplicated pred/true rows (in dict order) and the matching pairs between them
+    """
+    pred_rows, true_rows = dict_rows(pred_keys), dict_rows(true_keys)
+    partners = lookup(pred_keys[pred_rows], true_keys)
+    matched = partners >= 0
+    return pred_rows, true_rows, pred_rows[matched], partners[matched]
+
+
+def partner_rows(num_rows, rows, partners):
+    """
+    partner row of every row (-1 when unmatched) from the matching pairs of join
+    """
+    partner = np.full(num_rows, -1, dtype=np.int64)
+    partner[rows] = partners
+    return partner
+
+
+def joined_rows(pred_rows, true_rows, pred_matched, true_matched, num_pred, num_true):
+    """
+    rows of the join for the error reports: pred / true rows in dict order and their partners (-1 when missing)
+    """
+    return {
+        "pred": pred_rows,
+        "pred_match": partner_rows(num_pred, pred_matched, true_matched)[pred_rows],
+        "true": true_rows,
+        "true_match": partner_rows(num_true, true_matched, pred_matched)[true_rows],
+    }
+
+
+def prf(tp, fp, fn):
+    precision = tp / (tp + fp) if tp + fp > 0 else 0
+    recall = tp / (tp + fn) if tp + fn > 0 else 0
+    f1 = 2 * (precision * recall) / (precision + recall) if precision + recall > 0 else 0
+    return precision, recall, f1
+
+
+def evaluate_tables(pred, true, norm_categories=NormCategories, with_rows=False):
+    """
+    micro P/R/F1 (evaluation.evaluate_performance), per-category and macro F1
+    (evaluation.evaluate_macro_f1) and normalization scores (evaluation_norm.evaluate_performance)
+    with_rows: also return the joined rows ("rows", "norm"["rows"]) the FP/FN/TP reports are built from
+    """
+    vocab = pred.vocab
+    num_pred = len(pred)
+    keys = dense_ids(
+        np.concatenate([pred.fid, true.fid]),
+        np.concatenate([pred.start, true.start]),
+        np.concatenate([pred.end, true.end]),
+    )
+    pred_keys, true_keys = keys[:num_pred], keys[num_pred:]
+    pred_rows, true_rows, pred_matched, true_matched = join(pred_keys, true_keys)
+    same_type = pred.category[pred_matched] == true.category[true_matched]
+
+    # micro: a span with the wrong type is a false positive only
+    tp = int(same_type.sum())
+    fp = len(pred_rows) - tp
+    fn = len(true_rows) - len(pred_matched)
+    precision, recall, f1 = prf(tp, fp, fn)
+
+    # per category: a span with the wrong type is a false positive and a false negative
+    num_codes = len(vocab.strings)
+    tp_c = np.bincount(pred.category[pred_matched][same_type], minlength=num_codes)
+    pred_c = np.bincount(pred.category[pred_rows], minlength=num_codes)
+    true_c = np.bincount(true.category[true_rows], minlength=num_codes)
+    category_counts, category_f1_scores = {}, {}
+    for code in np.flatnonzero(pred_c + true_c):
+        counts = (int(tp_c[code]), int(pred_c[code] - tp_c[code]), int(true_c[code] - tp_c[code]))
+        category_counts[vocab.decode(code)] = counts
+        category_f1_scores[vocab.decode(code)] = prf(*counts)[2]
+    macro_f1 = sum(category_f1_scores.values()) / len(category_f1_scores) if category_f1_scores else 0
+
+    results = {
+        "precision": precision,
+        "recall": recall,
+        "f1": f1,
+        "tp": tp,
+        "fp": fp,
+        "fn": fn,
+        "macro_f1": macro_f1,
+        "category_f1": category_f1_scores,
+        "category_counts": category_counts,
+    }
+    if with_rows:
+        results["rows"] = joined_rows(pred_rows, true_rows, pred_matched, true_matched, len(pred), len(true))
+    if norm_categories:
+        results["norm"] = evaluate_norm_tables(pred, true, norm_categories, with_rows)
+    return results
+
+
+def table_rows(index, rows):
+    """
+    rows of a selected table (AnswerTable.select(index)) as rows of the full table, -1 kept
+    """
+    if len(index) == 0:
+        return np.full(len(rows), -1, dtype=np.int64)
+    return np.where(rows >= 0, index[np.maximum(rows, 0)], -1)
+
+
+def evaluate_norm_tables(pred, true, target_categories, with_rows=False):
+    """
+    spans of the target categories must also match the normalization
+    with_rows: joined rows, and for the unmatched ones the last row of the other side with the
+               same span ("pred_span", "true_span") and with the same start ("pred_start", "true_start")
+    """
+    target_codes = [pred.vocab.codes[cat] for cat in target_categories if cat in pred.vocab.codes]
+    pred_index = np.flatnonzero(np.isin(pred.category, target_codes))
+    true_index = np.flatnonzero(np.isin(true.category, target_codes))
+    pred, true = pred.select(pred_index), true.select(true_index)
+    num_pred = len(pred)
+    fids = np.concatenate([pred.fid, true.fid])
+    starts = np.concatenate([pred.start, true.start])
+    ends = np.concatenate([pred.end, true.end])
+    keys = dense_ids(fids, starts, ends, np.concatenate([pred.norm, true.norm]))
+    pred_rows, true_rows, pred_matched, true_matched = join(keys[:num_pred], keys[num_pred:])
+    tp = len(pred_matched)
+    fp = len(pred_rows) - tp
+    fn = len(true_rows) - tp
+    precision, recall, f1 = prf(tp, fp, fn)
+    results = {"precision": precision, "recall": recall, "f1": f1, "tp": tp, "fp": fp, "fn": fn}
+    if with_rows:
+        rows = joined_rows(pred_rows, true_rows, pred_matched, true_matched, num_pred, len(true))
+        span_keys, start_keys = dense_ids(fids, starts, ends), dense_ids(fids, starts)
+        pred_span = lookup(span_keys[:num_pred][rows["pred"]], span_keys[num_pred:])
+        pred_start = lookup(start_keys[:num_pred][rows["pred"]], start_keys[num_pred:])
+        true_span = lookup(span_keys[num_pred:][rows["true"]], span_keys[:num_pred])
+        true_start = lookup(start_keys[num_pred:][rows["true"]], start_keys[:num_pred])
+        # back to the rows of the full tables
+        results["rows"] = {
+            "pred": pred_index[rows["pred"]],
+            "pred_match": table_rows(true_index, rows["pred_match"]),
+            "pred_span": table_rows(true_index, pred_span),
+            "pred_start": table_rows(true_index, pred_start),
+            "true": true_index[rows["true"]],
+            "true_match": table_rows(pred_index, rows["true_match"]),
+            "true_span": table_rows(pred_index, true_span),
+            "true_start": table_rows(pred_index, true_start),
+        }
+    return results
+
+
+"""Per file id counts"""
+
+
+def grouped_counts(*columns):
+    """
+    {row tuple: number of rows} over the given integer columns
+    """
+    if len(columns[0]) == 0:
+        return {}
+    rows, counts = np.unique(np.stack(columns, axis=1), axis=0, return_counts=True)
+    return {tuple(row): count for row, count in zip(rows.tolist(), counts.tolist())}
+
+
+def counts_by_fid(pred, true, norm_categories=NormCategories):
+    """
+    the confusion counts of evaluate_tables split by file id
+    output : {fid: {"micro": [tp, fp, fn], "category": {category: [tp, fp, fn]}, "norm": [tp, fp, fn]}}
+    """
+    vocab = pred.vocab
+    num_pred = len(pred)
+    keys = dense_ids(
+        np.concatenate([pred.fid, true.fid]),
+        np.concatenate([pred.start, true.start]),
+        np.concatenate([pred.end, true.end]),
+    )
+    pred_rows, true_rows, pred_matched, true_matched = join(keys[:num_pred], keys[num_pred:])
+    same_type = pred.category[pred_matched] == true.category[true_matched]
+    pred_hit = np.zeros(len(pred), dtype=np.int32)
+    pred_hit[pred_matched[same_type]] = 1
+    true_hit = np.zeros(len(true), dtype=np.int32)
+    true_hit[true_matched[same_type]] = 1
+    true_found = np.zeros(len(true), dtype=np.int32)
+    true_found[true_matched] = 1
+
+    counts = {}
+
+    def fid_counts(fid):
+        fid = vocab.decode(fid)
+        if fid not in counts:
+            counts[fid] = {"micro": [0, 0, 0], "category": {}, "norm": [0, 0, 0]}
+        return counts[fid]
+
+    def category_counts(entry, category):
+        return entry["category"].setdefault(vocab.decode(category), [0, 0, 0])
+
+    for (fid, category, hit), num in grouped_counts(
+        pred.fid[pred_rows], pred.category[pred_rows], pred_hit[pred_rows]
+    ).items():
+        entry = fid_counts(fid)
+        slot = 0 if hit else 1
+        entry["micro"][slot] += num
+        category_counts(entry, category)[slot] += num
+
+    # a span with the wrong type is a false negative of its category only
+    for (fid, category, hit, found), num in grouped_counts(
+        true.fid[true_rows], true.category[true_rows], true_hit[true_rows], true_found[true_rows]
+    ).items():
+        entry = fid_counts(fid)
+        if not found:
+            entry["micro"][2] += num
+        if not hit:
+            category_counts(entry, category)[2] += num
+
+    if norm_categories:
+        for fid, norm in norm_counts_by_fid(pred, true, norm_categories).items():
+            fid_counts(vocab.codes[fid])["norm"] = norm
+    return counts
+
+
+def norm_counts_by_fid(pred, true, target_categories):
+    """
+    the counts of evaluate_norm_tables split by file id: {fid: [tp, fp, fn]}
+    """
+    vocab = pred.vocab
+    target_codes = [vocab.codes[cat] for cat in target_categories if cat in vocab.codes]
+    pred = pred.select(np.isin(pred.category, target_codes))
+    true = true.select(np.isin(true.category, target_codes))
+    num_pred = len(pred)
+    keys = dense_ids(
+        np.concatenate([pred.fid, true.fid]),
+        np.concatenate([pred.start, true.start]),
+        np.concatenate([pred.end, true.end]),
+        np.concatenate([pred.norm, true.norm]),
+    )
+    pred_rows, true_rows, pred_matched, true_matched = join(keys[:num_pred], keys[num_pred:])
+    pred_hit = np.zeros(len(pred), dtype=np.int32)
+    pred_hit[pred_matched] = 1
+    true_hit = np.zeros(len(true), dtype=np.int32)
+    true_hit[true_matched] = 1
+
+    counts = {}
+    for (fid, hit), num in grouped_counts(pred.fid[pred_rows], pred_hit[pred_rows]).items():
+        counts.setdefault(vocab.decode(fid), [0, 0, 0])[0 if hit else 1] += num
+    for (fid, hit), num in grouped_counts(true.fid[true_rows], true_hit[true_rows]).items():
+        if not hit:
+            counts.setdefault(vocab.decode(fid), [0, 0, 0])[2] += num
+    return counts
+
+
+def results_from_counts(counts, norm=True):
+    """
+    sum per file id counts (counts_by_fid) into the results of evaluate_tables
+    """
+    micro, norm_counts, category_counts = [0, 0, 0], [0, 0, 0], {}
+    for entry in counts.values():
+        for i in range(3):
+            micro[i] += entry["micro"][i]
+            norm_counts[i] += entry["norm"][i]
+        for category, values in entry["category"].items():
+            total = category_counts.setdefault(category, [0, 0, 0])
+            for i in range(3):
+                total[i] += values[i]
+
+    precision, recall, f1 = prf(*micro)
+    category_counts = {cat: tuple(values) for cat, values in category_counts.items() if any(values)}
+    category_f1_scores = {cat: prf(*values)[2] for cat, values in category_counts.items()}
+    macro_f1 = sum(category_f1_scores.values()) / len(category_f1_scores) if category_f1_scores else 0
+    results = {
+        "precision": precision,
+        "recall": recall,
+        "f1": f1,
+        "tp": micro[0],
+        "fp": micro[1],
+        "fn": micro[2],
+        "macro_f1": macro_f1,
+        "category_f1": category_f1_scores,
+        "category_counts": category_counts,
+    }
+    if norm:
+        precision, recall, f1 = prf(*norm_counts)
+        results["norm"] = {"precision": precision, "recall": recall, "f1": f1,
+                           "tp": norm_counts[0], "fp": norm_counts[1], "fn": norm_counts[2]}
+    return results
+
+
+def evaluate_files(pred_path, true_path, norm_categories=NormCategories):
+    vocab = Vocabulary()
+    true = AnswerTable.load(true_path, vocab)
+    pred = AnswerTable.load(pred_path, vocab)
+    return evaluate_tables(pred, true, norm_categories)
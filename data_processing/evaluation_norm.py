@@ -1,5 +1,6 @@
 import os
-import pandas as pd
+import error_report as ER
+import evaluation_core as EC
 
 def load_data(file_path):
     data = []
@@ -11,45 +12,64 @@ def load_data(file_path):
             data.append(parts)
     return data
 
-def evaluate_performance(pred_data, true_data, target_categories):
-    tp, fp, fn = 0, 0, 0
-    false_positives, false_negatives, true_positives = [], [], []
+ReportColumns = {
+    "false_positives": ["file_name", "pred_category", "start_pos", "end_pos",
+                        "pred_content", "pred_norm", "error", " gt"],
+    "false_negatives": ["file_name", "gt_category", "start_pos", "end_pos",
+                        "gt_content", "gt_norm_time", "error", "pred"],
+    "true_positives": ["file_name", "pred_category", "start_pos", "end_pos",
+                       "pred_content", "pred_norm"],
+}
 
-    pred_dict_norm = {(d[0], int(d[2]), int(d[3]), d[5] if len(d) > 5 else None): d for d in pred_data if d[1] in target_categories}
-    true_dict_norm = {(d[0], int(d[2]), int(d[3]), d[5] if len(d) > 5 else None): d for d in true_data if d[1] in target_categories}
-    true_dict = {(d[0], int(d[2]), int(d[3])): d for d in true_data if d[1] in target_categories}
-    pred_dict = {(d[0], int(d[2]), int(d[3])): d for d in pred_data if d[1] in target_categories}
-    true_start_dict = {(d[0], int(d[2])): d for d in true_data if d[1] in target_categories}
-    pred_start_dict = {(d[0], int(d[2])): d for d in pred_data if d[1] in target_categories}
-    
-    
-    for key, prediction in pred_dict_norm.items():
-        if key not in true_dict_norm:
-            fp += 1
-            if key[:3] in true_dict:
-                false_positives.append(prediction + ["norm wrong", true_dict[key[:3]][5]])
-            elif (key[0], key[1]) in true_start_dict:
-                false_positives.append(prediction + ["pred wrong", true_start_dict[(key[0],key[1])][4]])
-            else:
-                false_positives.append(prediction + ["not in answer", " "])
-        else:
-            tp += 1
-            true_positives.append(prediction)
 
-    for key, answer in true_dict_norm.items():
-        if key not in pred_dict_norm:
-            fn += 1
-            if key[:3] in pred_dict:
-                false_negatives.append(answer+ ["norm wrong", pred_dict[key[:3]][5]])
-            elif (key[0], key[1]) in pred_start_dict:
-                false_negatives.append(answer+["pred wrong", pred_start_dict[(key[0],key[1])][4]])
-            else:
-                false_negatives.append(answer + ["not predicted", " "])
+def evaluate_performance(pred_data, true_data, target_categories, reports=None):
+    """
+    norm P/R/F1 of EC.evaluate_tables with the FP/FN/TP rows of error_reports
+    """
+    vocab = EC.Vocabulary()
+    results = EC.evaluate_tables(EC.AnswerTable.from_rows(pred_data, vocab),
+                                 EC.AnswerTable.from_rows(true_data, vocab), target_categories, with_rows=True)
+    norm = results["norm"]
+    false_positives, false_negatives, true_positives = error_reports(pred_data, true_data, norm["rows"], reports)
+    return norm["precision"], norm["recall"], norm["f1"], false_positives, false_negatives, true_positives
 
-    precision = tp / (tp + fp) if tp + fp > 0 else 0
-    recall = tp / (tp + fn) if tp + fn > 0 else 0
-    f1 = 2 * (precision * recall) / (precision + recall) if precision + recall > 0 else 0
-    return precision, recall, f1, false_positives, false_negatives, true_positives
+def error_reports(pred_data, true_data, rows, reports=None):
+    """
+    the FP/FN/TP rows of evaluate_performance, built from the joined rows of
+    EC.evaluate_tables(..., with_rows=True)["norm"]["rows"] on the same pred_data / true_data
+    """
+    reports = reports or {}
+    false_positives, false_negatives, true_positives = [], [], []
+    for pred_row, true_row, span_row, start_row in zip(
+        rows["pred"].tolist(), rows["pred_match"].tolist(), rows["pred_span"].tolist(), rows["pred_start"].tolist()
+    ):
+        prediction = pred_data[pred_row]
+        if true_row >= 0:
+            ER.report_row(true_positives, prediction, reports.get("true_positives"))
+        elif span_row >= 0:
+            ER.report_row(false_positives, prediction + ["norm wrong", true_data[span_row][5]],
+                          reports.get("false_positives"))
+        elif start_row >= 0:
+            ER.report_row(false_positives, prediction + ["pred wrong", true_data[start_row][4]],
+                          reports.get("false_positives"))
+        else:
+            ER.report_row(false_positives, prediction + ["not in answer", " "], reports.get("false_positives"))
+
+    for true_row, pred_row, span_row, start_row in zip(
+        rows["true"].tolist(), rows["true_match"].tolist(), rows["true_span"].tolist(), rows["true_start"].tolist()
+    ):
+        answer = true_data[true_row]
+        if pred_row >= 0:
+            continue
+        if span_row >= 0:
+            ER.report_row(false_negatives, answer + ["norm wrong", pred_data[span_row][5]],
+                          reports.get("false_negatives"))
+        elif start_row >= 0:
+            ER.report_row(false_negatives, answer + ["pred wrong", pred_data[start_row][4]],
+                          reports.get("false_negatives"))
+        else:
+            ER.report_row(false_negatives, answer + ["not predicted", " "], reports.get("false_negatives"))
+    return false_positives, false_negatives, true_positives
 
 if __name__ == "__main__":
     target_categories = ["TIME", "DURATION", "SET", "DATE"]
@@ -63,19 +83,18 @@ if __name__ == "__main__":
     predictions = load_data(file_prediction_path)
     ground_truth = load_data(file_ground_path)
 
-    precision, recall, f1, false_positives, false_negatives, true_positives = evaluate_performance(predictions, ground_truth, target_categories)
-
-    fp_df = pd.DataFrame(false_positives, columns=["file_name", "pred_category", "start_pos", "end_pos", 
-                                      "pred_content", "pred_norm", "error", " gt"])
-    fn_df = pd.DataFrame(false_negatives, columns=["file_name", "gt_category", "start_pos", "end_pos", 
-                                      "gt_content", "gt_norm_time", "error", "pred"])
-    tp_df = pd.DataFrame(true_positives, columns=["file_name", "pred_category", "start_pos", "end_pos", 
-                                      "pred_content", "pred_norm"])
-    
-    
-    fp_df.to_excel(os.path.join(path, f'false_positives_{time}_norm.xlsx'), index=False)
-    fn_df.to_excel(os.path.join(path, f'false_negatives_{time}_norm.xlsx'),index=False)
-    tp_df.to_excel(os.path.join(path, f'true_positives_{time}_norm.xlsx'),index=False)
+    vocab = EC.Vocabulary()
+    results = EC.evaluate_tables(EC.AnswerTable.from_rows(predictions, vocab),
+                                 EC.AnswerTable.from_rows(ground_truth, vocab), target_categories, with_rows=True)
+    precision, recall, f1 = results["norm"]["precision"], results["norm"]["recall"], results["norm"]["f1"]
+    # error analysis: "xlsx" loads pandas/openpyxl, "tsv" and "parquet" are streamed
+    report_format = "tsv"
+    reports = ER.open_reports(path, f"{time}_norm", ReportColumns, report_format)
+    try:
+        error_reports(predictions, ground_truth, results["norm"]["rows"], reports)
+    finally:
+        for writer in reports.values():
+            writer.close()
     
     # Print the results
     print(f"Precision: {precision:.2f}, Recall: {recall:.2f}, F1 Score: {f1:.2f}")
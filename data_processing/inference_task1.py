@@ -0,0 +1,399 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Task1 inference: length-bucketed, token-budgeted batches for the pythia PHI model (prediction_*.txt)
+
+@author: huangpaveen
+"""
+
+import os
+import copy
+
+import torch
+
+import null_gate as NG
+import task_prefix as TP
+
+"""Data Setting"""
+Template = "<|endoftext|> __CONTENT__\n\n####\n\n"
+bos = "<|endoftext|>"
+eos = "<|END|>"
+pad = "<|pad|>"
+sep = "\n\n####\n\n"
+special_tokens_dict = {"eos_token": eos, "bos_token": bos, "pad_token": pad, "sep_token": sep}
+"""Model Constant Setting"""
+MaxLen = 196
+ValBatchSize = 128
+MaxBatchTokens = 128 * 96
+# early stopping: labels that end a row, and a generation budget of base + ratio * source characters
+NullLabels = ["PHI:Null", "PHI:NULL"]
+GenerationBase = 16
+GenerationRatio = 0.75
+# continuous batching: pending rows join once this share of the running batch has finished
+RefillRatio = 0.25
+PretrainedModel = "EleutherAI/pythia-160m"
+
+
+def remove_prefixes(text):
+    if TP.TaskPrefixOriginal in text:
+        text = text.replace(TP.TaskPrefixOriginal, "")
+    if TP.TaskPrefixSliced in text:
+        text = text.replace(TP.TaskPrefixSliced, "")
+    if TP.TaskPrefixSpliced in text:
+        text = text.replace(TP.TaskPrefixSpliced, "")
+    return text
+
+
+def reading_validation_data(val_path, task_prefix):
+    """
+    validation tsv (fid, idx, content, label) as dicts, the task prefix added to the content
+    """
+    val_data = []
+    with open(val_path, "r", encoding="utf-8") as fr:
+        for line in fr:
+            parts = line.rstrip("\n").split("\t")
+            if len(parts) < 3:
+                continue
+            val_data.append({"fid": parts[0], "idx": int(parts[1]), "content": task_prefix + parts[2]})
+    return val_data
+
+
+"""Batch scheduling"""
+
+
+def token_budget_batches(lengths, max_tokens=MaxBatchTokens, max_batch_size=ValBatchSize):
+    """
+    indices sorted by length and grouped so that a batch padded to its longest row
+    holds at most max_tokens tokens and max_batch_size rows
+    """
+    order = sorted(range(len(lengths)), key=lambda i: lengths[i])
+    batches, batch = [], []
+    for i in order:
+        # rows come sorted, so the new row is the longest of the batch
+        if batch and ((len(batch) + 1) * lengths[i] > max_tokens or len(batch) == max_batch_size):
+            batches.append(batch)
+            batch = []
+        batch.append(i)
+    if batch:
+        batches.append(batch)
+    return batches
+
+
+def decode_prediction(pred, row, tokenizer):
+    """
+    generated text -> prediction line, None for null or malformed answers (aicup_predict)
+    """
+    sep, eos, pad = tokenizer.sep_token, tokenizer.eos_token, tokenizer.pad_token
+    if "NULL" in pred or sep not in pred:
+        return None
+    content = remove_prefixes(row["content"])
+    phi_infos = pred[pred.index(sep) + len(sep):].replace(pad, "").replace(eos, "").strip()
+    return f'{row["fid"]}\t{row["idx"]}\t{content}\t{phi_infos}'
+
+
+def aicup_predict(model, tokenizer, input, template=Template, max_new_tokens=MaxLen):
+    """
+    Generate text from a trained model, one prediction or None per input row
+    """
+    seeds = [template.replace("__CONTENT__", data["content"]) for data in input]
+    pad_idx = tokenizer.convert_tokens_to_ids(tokenizer.pad_token)
+    model.eval()
+    device = model.device
+    texts = tokenizer(seeds, return_tensors="pt", padding=True, truncation=True, max_length=MaxLen).to(device)
+
+    with torch.no_grad(), torch.autocast("cuda", enabled=device.type == "cuda"):
+        output_tokens = model.generate(**texts, max_new_tokens=max_new_tokens, pad_token_id=pad_idx,
+                                       eos_token_id=tokenizer.convert_tokens_to_ids(tokenizer.eos_token))
+    preds = tokenizer.batch_decode(output_tokens)
+    return [decode_prediction(pred, row, tokenizer) for pred, row in zip(preds, input)]
+
+
+"""Prefix key/value cache"""
+
+
+def repeat_cache(cache, batch_size):
+    cache = copy.deepcopy(cache)
+    if hasattr(cache, "batch_repeat_interleave"):
+        cache.batch_repeat_interleave(batch_size)
+        return cache
+    # legacy tuple cache: ((key, value), ...) per layer
+    return tuple(tuple(t.repeat_interleave(batch_size, dim=0) for t in layer) for layer in cache)
+
+
+def select_cache(cache, indices):
+    if hasattr(cache, "batch_select_indices"):
+        cache.batch_select_indices(indices)
+        return cache
+    return tuple(tuple(t[indices] for t in layer) for layer in cache)
+
+
+class PrefixCache:
+    """
+    key/value cache of the prompt prefixes shared by every row ("<|endoftext|> Original records: ", ...),
+    computed once so that each batch only runs the model over the row content
+    """
+
+    def __init__(self, model, tokenizer, task_prefixes=tuple(TP.TaskPrefixes.values()),
+                 template=Template):
+        head = template.split("__CONTENT__")[0]
+        self.prefix_ids, self.caches = [], []
+        model.eval()
+        for task_prefix in task_prefixes:
+            # the last token may merge with the first word of the content
+            ids = tokenizer(head + task_prefix)["input_ids"][:-1]
+            with torch.no_grad():
+                output = model(input_ids=torch.tensor([ids], device=model.device), use_cache=True)
+            self.prefix_ids.append(ids)
+            self.caches.append(output.past_key_values)
+
+    def match(self, ids):
+        """
+        index of the longest cached prefix the token ids start with, None if there is none
+        """
+        best = None
+        for prefix_idx, prefix_ids in enumerate(self.prefix_ids):
+            if ids[:len(prefix_ids)] == prefix_ids and (best is None or len(prefix_ids) > len(self.prefix_ids[best])):
+                best = prefix_idx
+        return best
+
+
+def generation_budgets(source_lengths, max_new_tokens=MaxLen, base=GenerationBase, ratio=GenerationRatio):
+    """
+    labels copy spans of the source, so a row never needs much more than its own length
+    source_lengths : characters of each row content, without the task prefix
+    """
+    return [min(max_new_tokens, base + int(ratio * length)) for length in source_lengths]
+
+
+def merge_caches(first, second):
+    """
+    batch concatenation of two caches, the shorter one left-padded along the sequence (masked positions)
+    """
+    def merge(a, b):
+        length = max(a.shape[-2], b.shape[-2])
+        a, b = (torch.nn.functional.pad(t, (0, 0, length - t.shape[-2], 0)) for t in (a, b))
+        return torch.cat([a, b], dim=0)
+
+    if hasattr(first, "layers"):
+        for layer, other in zip(first.layers, second.layers):
+            layer.keys, layer.values = merge(layer.keys, other.keys), merge(layer.values, other.values)
+        return first
+    return tuple(tuple(merge(a, b) for a, b in zip(layer, other)) for layer, other in zip(first, second))
+
+
+def prompt_batch(suffix_ids, pad_id, cache, prefix_len, device):
+    """
+    left-padded prompts of new rows, continuing from the cached prefix
+    """
+    max_len = max(len(ids) for ids in suffix_ids)
+    attention_mask = torch.tensor(
+        [[1] * prefix_len + [0] * (max_len - len(ids)) + [1] * len(ids) for ids in suffix_ids], device=device
+    )
+    return {
+        "input_ids": torch.tensor([[pad_id] * (max_len - len(ids)) + ids for ids in suffix_ids], device=device),
+        "attention_mask": attention_mask,
+        "position_ids": (attention_mask.cumsum(-1) - 1).clamp(min=0)[:, prefix_len:],
+        "cache": repeat_cache(cache, len(suffix_ids)) if cache is not None else None,
+    }
+
+
+def merge_batches(first, second):
+    """
+    running batch + newly prefilled rows, both waiting for their next input token
+    """
+    length = max(first["attention_mask"].shape[1], second["attention_mask"].shape[1])
+    attention_mask = [
+        torch.nn.functional.pad(batch["attention_mask"], (length - batch["attention_mask"].shape[1], 0))
+        for batch in (first, second)
+    ]
+    return {
+        "input_ids": torch.cat([first["input_ids"], second["input_ids"]]),
+        "attention_mask": torch.cat(attention_mask),
+        "position_ids": torch.cat([first["position_ids"], second["position_ids"]]),
+        "cache": merge_caches(first["cache"], second["cache"]),
+    }
+
+
+def decode_step(model, batch, rows, finished):
+    """
+    one forward pass: the next token of every row, finished rows removed from the batch and its cache
+    output : rows still running, their batch fed with the new tokens (None when every row finished)
+    """
+    output = model(input_ids=batch["input_ids"], attention_mask=batch["attention_mask"],
+                   position_ids=batch["position_ids"], past_key_values=batch["cache"], use_cache=True)
+    next_tokens = output.logits[:, -1].argmax(-1)
+    # finished() records the token of every row
+    keep = [pos for pos, (row, token) in enumerate(zip(rows, next_tokens.tolist())) if not finished(row, token)]
+    if not keep:
+        return [], None
+    attention_mask, position_ids, cache = batch["attention_mask"], batch["position_ids"], output.past_key_values
+    if len(keep) < len(rows):
+        index = torch.tensor(keep, device=next_tokens.device)
+        next_tokens, attention_mask, position_ids = next_tokens[index], attention_mask[index], position_ids[index]
+        cache = select_cache(cache, index)
+    return [rows[pos] for pos in keep], {
+        "input_ids": next_tokens[:, None],
+        "attention_mask": torch.cat([attention_mask, attention_mask.new_ones(len(keep), 1)], dim=-1),
+        "position_ids": position_ids[:, -1:] + 1,
+        "cache": cache,
+    }
+
+
+def greedy_generate(model, suffix_ids, pad_id, eos_id, max_new_tokens, cache=None, prefix_len=0,
+                    budgets=None, stop_ids=(), max_batch_size=None, max_tokens=None):
+    """
+    greedy decoding as model.generate, continuing from a cached prefix of prefix_len tokens
+    a row stops on <|END|>, when its output starts with one of stop_ids or after its budget
+
+    continuous batching: rows join in the given order while the running batch holds at most max_batch_size
+    rows and max_tokens prompt tokens (padded to the longest prompt after the prefix, as token_budget_batches;
+    None: no limit), finished rows leave the batch and its cache, and once RefillRatio of the batch has
+    finished, pending rows are prefilled and merged into the free slots
+
+    suffix_ids : token ids of each row after the prefix
+    output : generated ids of each row
+    """
+    device = model.device
+    num_rows = len(suffix_ids)
+    max_batch_size = max_batch_size or num_rows
+    budgets = budgets or [max_new_tokens] * num_rows
+    generated = [[] for _ in range(num_rows)]
+
+    def finished(row, token):
+        tokens = generated[row]
+        tokens.append(token)
+        if token == eos_id or len(tokens) >= budgets[row]:
+            return True
+        return any(tokens[:len(ids)] == ids for ids in stop_ids if len(tokens) >= len(ids))
+
+    active, batch, next_row, capacity = [], None, 0, 0
+    while active or next_row < num_rows:
+        if next_row < num_rows and (not active or len(active) <= capacity - max(1, int(capacity * RefillRatio))):
+            # pending rows for the free slots, max_tokens bounds the prompts padded to the longest one
+            longest = max((len(suffix_ids[row]) for row in active), default=0)
+            new_rows = []
+            while next_row < num_rows and len(active) + len(new_rows) < max_batch_size:
+                longest = max(longest, len(suffix_ids[next_row]))
+                if max_tokens and (active or new_rows) and (len(active) + len(new_rows) + 1) * longest > max_tokens:
+                    break
+                new_rows.append(next_row)
+                next_row += 1
+            if new_rows:
+                new_batch = prompt_batch([suffix_ids[row] for row in new_rows], pad_id, cache, prefix_len, device)
+                new_rows, new_batch = decode_step(model, new_batch, new_rows, finished)
+                if new_rows:
+                    batch = merge_batches(batch, new_batch) if active else new_batch
+                    active = active + new_rows
+                capacity = len(active)
+                continue
+        active, batch = decode_step(model, batch, active, finished)
+    return generated
+
+
+def aicup_predict_cached(model, tokenizer, input, input_ids, prefix_cache, prefix_idx, max_new_tokens=MaxLen,
+                         early_stop=False, max_batch_size=None, max_tokens=None):
+    """
+    aicup_predict over rows sharing the cached prefix prefix_idx (None: no prefix)
+    input_ids : full prompt token ids of each row
+    early_stop: stop rows on a null label and after a budget scaled by their length (generation_budgets)
+    max_batch_size, max_tokens: limits of the running batch (greedy_generate)
+    """
+    prefix_len = len(prefix_cache.prefix_ids[prefix_idx]) if prefix_idx is not None else 0
+    cache = prefix_cache.caches[prefix_idx] if prefix_idx is not None else None
+    pad_idx = tokenizer.convert_tokens_to_ids(tokenizer.pad_token)
+    eos_idx = tokenizer.convert_tokens_to_ids(tokenizer.eos_token)
+    suffix_ids = [ids[prefix_len:] for ids in input_ids]
+    budgets, stop_ids = None, ()
+    if early_stop:
+        budgets = generation_budgets([len(remove_prefixes(row["content"])) for row in input], max_new_tokens)
+        stop_ids = [tokenizer(label, add_special_tokens=False)["input_ids"] for label in NullLabels]
+    with torch.no_grad(), torch.autocast("cuda", enabled=model.device.type == "cuda"):
+        generated = greedy_generate(model, suffix_ids, pad_idx, eos_idx, max_new_tokens, cache, prefix_len,
+                                    budgets, stop_ids, max_batch_size, max_tokens)
+    preds = tokenizer.batch_decode([ids + gen for ids, gen in zip(input_ids, generated)])
+    return [decode_prediction(pred, row, tokenizer) for pred, row in zip(preds, input)]
+
+
+def predict_rows(model, tokenizer, val_data, template=Template, max_tokens=MaxBatchTokens,
+                 max_batch_size=ValBatchSize, max_new_tokens=MaxLen, prefix_cache=None, early_stop=False):
+    """
+    predictions of every row in the original order, computed in length-sorted batches
+    prefix_cache: PrefixCache, the shared prompt prefix is not run again for every batch
+    early_stop: per-row stopping (aicup_predict_cached)
+    with a prefix cache or early stopping, the rows of each prefix run through one continuously
+    refilled batch (greedy_generate) instead of fixed batches
+    """
+    seeds = [template.replace("__CONTENT__", data["content"]) for data in val_data]
+    encoded = tokenizer(seeds, truncation=True, max_length=MaxLen)["input_ids"]
+    predictions = [None] * len(val_data)
+    if prefix_cache is None and not early_stop:
+        for batch in token_budget_batches([len(ids) for ids in encoded], max_tokens, max_batch_size):
+            batch_predictions = aicup_predict(model, tokenizer, [val_data[i] for i in batch], template, max_new_tokens)
+            for i, prediction in zip(batch, batch_predictions):
+                predictions[i] = prediction
+        return predictions
+
+    groups = {}
+    for i, ids in enumerate(encoded):
+        groups.setdefault(prefix_cache.match(ids) if prefix_cache else None, []).append(i)
+    for prefix_idx, rows in groups.items():
+        # shortest rows first, like token_budget_batches
+        rows = sorted(rows, key=lambda i: len(encoded[i]))
+        group_predictions = aicup_predict_cached(model, tokenizer, [val_data[i] for i in rows],
+                                                 [encoded[i] for i in rows], prefix_cache, prefix_idx,
+                                                 max_new_tokens, early_stop, max_batch_size, max_tokens)
+        for i, prediction in zip(rows, group_predictions):
+            predictions[i] = prediction
+    return predictions
+
+
+def write_predictions(predictions, prediction_path):
+    with open(prediction_path, "w", encoding="utf8") as f_predictions:
+        for prediction in predictions:
+            if prediction is not None:
+                f_predictions.write(prediction + "\n")
+
+
+def load_model(checkpoint_path, pretrained_model=PretrainedModel, device=None):
+    """
+    pythia with the special tokens of the training notebooks, weights saved by torch.save(model.state_dict())
+    """
+    from transformers import AutoTokenizer, AutoModelForCausalLM, AutoConfig
+
+    device = device or torch.device("cuda" if torch.cuda.is_available() else "cpu")
+    tokenizer = AutoTokenizer.from_pretrained(pretrained_model, revision="step3000")
+    tokenizer.padding_side = "left"
+    tokenizer.add_special_tokens(special_tokens_dict)
+    config = AutoConfig.from_pretrained(pretrained_model,
+                                        bos_token_id=tokenizer.bos_token_id,
+                                        eos_token_id=tokenizer.eos_token_id,
+                                        pad_token_id=tokenizer.pad_token_id,
+                                        sep_token_id=tokenizer.sep_token_id,
+                                        output_hidden_states=False)
+    model = AutoModelForCausalLM.from_pretrained(pretrained_model, revision="step3000", config=config)
+    model.resize_token_embeddings(len(tokenizer))
+    model.load_state_dict(torch.load(checkpoint_path, map_location=device))
+    return model.to(device), tokenizer
+
+
+if __name__ == "__main__":
+    data_path = os.path.join(os.getcwd(), "data")
+    name = "1701407216"
+    model_name = os.path.join(os.getcwd(), f"model/{name}/best_{name}.pt")
+    prediction_path = os.path.join(os.getcwd(), f"model/{name}/prediction_{name}.txt")
+
+    val_data = []
+    for kind, task_prefix in TP.TaskPrefixes.items():
+        val_data += reading_validation_data(os.path.join(data_path, f"valid_phase1_v8_{kind}.tsv"), task_prefix)
+    print("validation length:", len(val_data))
+
+    # skip lines the null gate (null_gate.py) scores as PHI:Null
+    gate_path = os.path.join(data_path, "null_gate.npz")
+    if os.path.exists(gate_path):
+        val_data, report = NG.filter_rows(NG.NullGate.load(gate_path), val_data, list(TP.TaskPrefixes.values()))
+        print(f"null gate: skipped {report['skipped']}/{report['total']} lines (threshold {report['threshold']:.4f})")
+
+    model, tokenizer = load_model(model_name)
+    prefix_cache = PrefixCache(model, tokenizer)
+    predictions = predict_rows(model, tokenizer, val_data, prefix_cache=prefix_cache, early_stop=True)
+    write_predictions(predictions, prediction_path)
@@ -0,0 +1,143 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Task2 batch inference: length-bucketed generation of the time normalizations (answer_*_norm.txt)
+
+@author: huangpaveen
+"""
+
+import os
+
+import torch
+
+import rule_normalizer as RN
+
+"""Data Setting"""
+TaskPrefix = "Time normalization: "
+NormCategory = ["DATE", "TIME", "DURATION", "SET"]
+"""Model Constant Setting"""
+MaxLen = 32
+BatchSize = 64
+PretrainedModel = "google/flan-t5-base"
+
+
+def read_answer_rows(answer_path):
+    """
+    answer lines split by tab: fid, category, start, end, content
+    """
+    rows = []
+    with open(answer_path, "r", encoding="utf-8") as fr:
+        for line in fr:
+            line = line.rstrip("\n")
+            if line:
+                rows.append(line.split("\t"))
+    return rows
+
+
+def length_batches(lengths, batch_size):
+    """
+    indices sorted by token length and cut into batches, each one padded only to its own longest input
+    """
+    order = sorted(range(len(lengths)), key=lambda i: lengths[i])
+    return [order[i:i + batch_size] for i in range(0, len(order), batch_size)]
+
+
+def generate_batches(model, tokenizer, texts, batch_size=BatchSize, max_length=MaxLen, **generate_kwargs):
+    """
+    generate one answer per text, batched by length
+
+    output : decoded answers in the order of texts
+    """
+    device = model.device
+    encoded = tokenizer(texts, truncation=True, max_length=max_length)["input_ids"]
+    answers = [None] * len(texts)
+    model.eval()
+    for batch in length_batches([len(ids) for ids in encoded], batch_size):
+        inputs = tokenizer.pad({"input_ids": [encoded[i] for i in batch]}, return_tensors="pt").to(device)
+        with torch.no_grad():
+            output_tokens = model.generate(**inputs, **generate_kwargs)
+        for i, answer in zip(batch, tokenizer.batch_decode(output_tokens, skip_special_tokens=True)):
+            answers[i] = answer
+    return answers
+
+
+def normalize_rows(model, tokenizer, rows, batch_size=BatchSize, use_rules=False, **generate_kwargs):
+    """
+    normalization of every DATE / TIME / DURATION / SET row, None for the other categories
+    use_rules: answer spans resolved by rule_normalizer without the model
+    """
+    normalizations = [None] * len(rows)
+    targets = [
+        idx for idx, parts in enumerate(rows) if len(parts) >= 5 and parts[1] in NormCategory and parts[4]
+    ]
+    if use_rules:
+        rule_answers, unresolved = RN.split_by_rules([rows[idx] for idx in targets])
+        for local_idx, normalization in rule_answers.items():
+            normalizations[targets[local_idx]] = normalization
+        targets = [targets[local_idx] for local_idx in unresolved]
+
+    texts = [TaskPrefix + rows[idx][1] + ":" + rows[idx][4] for idx in targets]
+    answers = generate_batches(model, tokenizer, texts, batch_size, **generate_kwargs)
+    for idx, answer in zip(targets, answers):
+        normalizations[idx] = answer
+    return normalizations
+
+
+def write_norm_answers(rows, normalizations, output_path):
+    """
+    one line per answer row in the original order, the normalization column only when it is not empty
+    """
+    with open(output_path, "w", encoding="utf8") as f_predictions:
+        for parts, normalization in zip(rows, normalizations):
+            if len(parts) < 5 or not parts[1] or not parts[4]:
+                print("[ERROR] No cat or content")
+                continue
+            fid, cat, spo, epo, content = parts[:5]
+            if normalization:
+                f_predictions.write(f"{fid}\t{cat}\t{spo}\t{epo}\t{content}\t{normalization}\n")
+            else:
+                f_predictions.write(f"{fid}\t{cat}\t{spo}\t{epo}\t{content}\n")
+
+
+def normalize_answer_file(model, tokenizer, answer_path, output_path=None, batch_size=BatchSize,
+                          use_rules=False, **generate_kwargs):
+    """
+    answer_*.txt -> answer_*_norm.txt
+    """
+    output_path = output_path or answer_path.replace(".txt", "_norm.txt")
+    rows = read_answer_rows(answer_path)
+    normalizations = normalize_rows(model, tokenizer, rows, batch_size, use_rules, **generate_kwargs)
+    write_norm_answers(rows, normalizations, output_path)
+    return output_path
+
+
+def load_model(checkpoint_path, pretrained_model=PretrainedModel, lora=True, device=None):
+    """
+    flan-t5 with the LoRA adaptor of PHI_flant5_v2_task2_LoRA, weights saved by torch.save(model.state_dict())
+    """
+    from transformers import T5Tokenizer, T5ForConditionalGeneration
+
+    device = device or torch.device("cuda" if torch.cuda.is_available() else "cpu")
+    tokenizer = T5Tokenizer.from_pretrained(pretrained_model)
+    model = T5ForConditionalGeneration.from_pretrained(pretrained_model)
+    if lora:
+        from peft import LoraConfig, get_peft_model, TaskType
+
+        lora_config = LoraConfig(
+            r=16, lora_alpha=32, target_modules=["q", "v"], lora_dropout=0.05, bias="none",
+            task_type=TaskType.SEQ_2_SEQ_LM
+        )
+        model = get_peft_model(model, lora_config)
+    model.load_state_dict(torch.load(checkpoint_path, map_location=device))
+    return model.to(device), tokenizer
+
+
+if __name__ == "__main__":
+    path = os.path.join(os.getcwd(), "Result/val")
+    answer_name = "answer_1701317300_1701181213.txt"
+    name = "1701339576_flant5_v1_base_task2"
+    checkpoint = os.path.join(os.getcwd(), f"model/{name}/best_{name[:10]}.pt")
+
+    model, tokenizer = load_model(checkpoint)
+    output_path = normalize_answer_file(model, tokenizer, os.path.join(path, answer_name))
+    print(output_path)
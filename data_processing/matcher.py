@@ -0,0 +1,85 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Multi-pattern string matching (Aho-Corasick)
+
+@author: huangpaveen
+"""
+
+from collections import deque
+from functools import lru_cache
+
+
+class AhoCorasick:
+    """
+    Find all occurrences of a set of literal patterns in one pass over the text
+    """
+
+    def __init__(self, patterns):
+        self.patterns = list(patterns)
+        self.goto = [{}]
+        self.fail = [0]
+        self.output = [[]]
+        for pattern_idx, pattern in enumerate(self.patterns):
+            if pattern:
+                self._add_pattern(pattern, pattern_idx)
+        self._build_fail_links()
+
+    def _add_pattern(self, pattern, pattern_idx):
+        node = 0
+        for char in pattern:
+            next_node = self.goto[node].get(char)
+            if next_node is None:
+                next_node = len(self.goto)
+                self.goto[node][char] = next_node
+                self.goto.append({})
+                self.fail.append(0)
+                self.output.append([])
+            node = next_node
+        self.output[node].append(pattern_idx)
+
+    def _build_fail_links(self):
+        queue = deque(self.goto[0].values())
+        while queue:
+            node = queue.popleft()
+            for char, next_node in self.goto[node].items():
+                queue.append(next_node)
+                fail_node = self.fail[node]
+                while fail_node and char not in self.goto[fail_node]:
+                    fail_node = self.fail[fail_node]
+                self.fail[next_node] = self.goto[fail_node].get(char, 0)
+                self.output[next_node] = self.output[next_node] + self.output[self.fail[next_node]]
+
+    def iter_matches(self, text):
+        """
+        all (start, end, pattern_idx) occurrences, overlapping ones included, ordered by end
+        """
+        node = 0
+        for end, char in enumerate(text, 1):
+            while node and char not in self.goto[node]:
+                node = self.fail[node]
+            node = self.goto[node].get(char, 0)
+            for pattern_idx in self.output[node]:
+                yield end - len(self.patterns[pattern_idx]), end, pattern_idx
+
+    def finditer(self, text):
+        """
+        same matches as re.finditer(re.escape(pattern), text) for every pattern:
+        non-overlapping per pattern, while different patterns may overlap
+
+        output : (start, end, pattern_idx) list ordered by pattern then start
+        """
+        matches = [[] for _ in self.patterns]
+        for start, end, pattern_idx in self.iter_matches(text):
+            pattern_matches = matches[pattern_idx]
+            if not pattern_matches or start >= pattern_matches[-1][1]:
+                pattern_matches.append((start, end, pattern_idx))
+        return [match for pattern_matches in matches for match in pattern_matches]
+
+
+@lru_cache(maxsize=4096)
+def build_matcher(patterns):
+    """
+    cached automaton for a tuple of patterns
+    """
+    return AhoCorasick(patterns)
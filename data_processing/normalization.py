@@ -9,34 +9,44 @@ Created on Mon Nov 27 23:11:19 2023
 import os
 import re
 from datetime import datetime
+from functools import lru_cache
+
+# 'D/M/YYYY', 'D.M.YYYY', 'DDMMYYYY' and 'D.M.YY'
+DatePattern = re.compile(r'(\d{1,2})[./](\d{1,2})[./](\d{2,4})|(\d{8})')
+NormalizedDatePattern = re.compile(r'(\d{2,4})-(\d{2})-(\d{2})')
+# YYYY-MM-DD followed by 'T'
+TimeDatePattern = re.compile(r'\b(\d{2,4}-\d{2}-\d{2})T')
+AmPmPattern = re.compile(r'(\d{1,2})[:.](\d{2})\s*(am|pm)', re.IGNORECASE)
+NormalizedTimePattern = re.compile(r'T\d{2}:\d{2}')
 
 
 def read_file(path):
     with open(path, "r", encoding="utf-8-sig") as fr:
         return fr.readlines()
     
+def current_century():
+    return str(datetime.now().year)[:2]
+
+
 def recognize_normalized_date(text):
-    date_pattern = r'(\d{2,4})-(\d{2})-(\d{2})'
-    matches = re.findall(date_pattern, text)
-    if matches:
-        return matches[0] 
+    match = NormalizedDatePattern.search(text)
+    if match:
+        return match.groups()
     return 
 
 def extract_date(datetime_string):
     # This regex matches a date in the format YYYY-MM-DD that is followed by 'T'
-    date_pattern = re.compile(r'\b(\d{2,4}-\d{2}-\d{2})T')
-    match = date_pattern.search(datetime_string)
+    match = TimeDatePattern.search(datetime_string)
     return match.group(1) if match else None
 
 
-def date_normalization(original_date, normalized_date, cat="DATE"):
+def date_normalization(original_date, normalized_date, cat="DATE", century=None):
     # This pattern matches dates in 'D/M/YYYY', 'D.M.YYYY', 'DDMMYYYY', and 'D.M.YY' formats
-    date_pattern = r'(\d{1,2})[./](\d{1,2})[./](\d{2,4})|(\d{8})'
-    match = re.match(date_pattern, original_date.replace(' ', ''))
+    match = DatePattern.match(original_date.replace(' ', ''))
     if cat == "TIME":
         tmp_list = original_date.split(" ")
         for tmp in tmp_list:
-            match = re.match(date_pattern, tmp)
+            match = DatePattern.match(tmp)
             if match:
                 break
     if match:
@@ -48,9 +58,7 @@ def date_normalization(original_date, normalized_date, cat="DATE"):
         day = day.zfill(2)
         month = month.zfill(2)
         if len(year) == 2:
-            current_year = str(datetime.now().year)
-            century = current_year[:2]
-            year = century + year
+            year = (century or current_century()) + year
         elif len(year) == 3 or len(year) == 1:
             return normalized_date
         
@@ -66,7 +74,7 @@ def date_normalization(original_date, normalized_date, cat="DATE"):
 
 def time_normalization(original_string, generated_answer):
     # am_pm_time_match = re.search(r'(\d{1,2})[:.](\d{2})(am|pm)', original_string, re.IGNORECASE)
-    am_pm_time_match = re.search(r'(\d{1,2})[:.](\d{2})\s*(am|pm)', original_string, re.IGNORECASE)
+    am_pm_time_match = AmPmPattern.search(original_string)
     if not am_pm_time_match:
         return generated_answer  # No AM/PM time found, return original answer
 
@@ -86,11 +94,47 @@ def time_normalization(original_string, generated_answer):
     corrected_time = f"{hours:02d}:{minutes:02d}"
 
     # Replace the time in the generated answer with the corrected time
-    corrected_answer = re.sub(r'T\d{2}:\d{2}', f'T{corrected_time}', generated_answer)
+    corrected_answer = NormalizedTimePattern.sub(f'T{corrected_time}', generated_answer)
 
     return corrected_answer
 
 
+class Normalizer:
+    """
+    post-processing of the generated normalizations (answer_*_norm.txt)
+    the century is resolved once, and (category, content, normalization) results are
+    memoized since the same date strings repeat across reports
+    """
+
+    def __init__(self, century=None, cache_size=65536):
+        self.century = century or current_century()
+        self.normalize = lru_cache(maxsize=cache_size)(self._normalize)
+
+    def _normalize(self, category, content, normalization):
+        if category == "DATE":
+            normalization = date_normalization(content, normalization, century=self.century)
+        elif category == "TIME":
+            time_date = extract_date(normalization)
+            if time_date:
+                time_date_corrected = date_normalization(content, time_date, "TIME", self.century)
+                normalization = normalization.replace(time_date, time_date_corrected)
+            normalization = time_normalization(content, normalization)
+        return normalization
+
+    def normalize_line(self, line):
+        parts = line.strip().split('\t')
+        if len(parts) == 6:
+            parts[5] = self.normalize(parts[1], parts[4], parts[5])
+        return "\t".join(parts) + "\n"
+
+    def normalize_lines(self, lines):
+        """
+        stream corrected answer lines
+        """
+        for line in lines:
+            yield self.normalize_line(line)
+
+
 if __name__ == "__main__":
     path = os.path.join(os.getcwd(),"Result")
     # path = os.path.join(os.getcwd(),"Result/val")
@@ -98,30 +142,6 @@ if __name__ == "__main__":
     file_path = os.path.join(path, answer)
     save_path =  os.path.join(path, answer.replace(".txt", "_clean.txt"))
     
-    lines = read_file(file_path)
-    
-    with open(save_path, 'w', encoding='utf-8') as file:
-        for line in lines:
-            # Split each line by tab character
-            parts = line.strip().split('\t')
-            if len(parts) == 6:
-                fid, category, start_pos, end_pos, content, normalization = parts
-                if "4:50pm 08.03.65" in content:
-                    print()
-                if category == "DATE":
-                    normalization = date_normalization(content, normalization)
-                elif category == "TIME":
-                    time_date = extract_date(normalization)
-                    if time_date:
-                        time_date_corrected = date_normalization(content, time_date, "TIME")
-                        normalization = normalization.replace(time_date, time_date_corrected)
-                    normalization = time_normalization(content, normalization)
-                file.write(f"{fid}\t{category}\t{start_pos}\t{end_pos}\t{content}\t{normalization}\n")
-            else:
-                fid, category, start_pos, end_pos, content = parts
-                file.write(f"{fid}\t{category}\t{start_pos}\t{end_pos}\t{content}\n")
-                
-                
-                
-
-
+    normalizer = Normalizer()
+    with open(file_path, "r", encoding="utf-8-sig") as fr, open(save_path, 'w', encoding='utf-8') as file:
+        file.writelines(normalizer.normalize_lines(fr))
@@ -0,0 +1,182 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Null-line gate: hashed character n-gram logistic regression that skips PHI:Null lines before task1 generation
+
+@author: huangpaveen
+"""
+
+import os
+import re
+import glob
+
+import numpy as np
+
+PHINull = "PHI:Null"
+RandomSeed = 1025
+NumFeatures = 2 ** 18
+NgramRange = (2, 4)
+TargetRecall = 0.995
+HashBase = np.uint64(1000003)
+# word shapes: digits and capitalized words are the usual PHI hints (names, dates, ids)
+ShapePatterns = [re.compile(pattern) for pattern in [
+    r"\d", r"\d{4,}", r"\d{1,2}[./]\d{1,2}[./]\d{2,4}", r"\b[A-Z][a-z]+\b", r"\b[A-Z]{2,}\b", r"\d{1,2}:\d{2}"
+]]
+
+
+def read_tsv(path):
+    """
+    v8 tsv (fid, idx, content, label) -> contents, is-PHI flags
+    """
+    texts, labels = [], []
+    with open(path, "r", encoding="utf-8") as fr:
+        for line in fr:
+            parts = line.rstrip("\n").split("\t")
+            if len(parts) < 4:
+                continue
+            texts.append(parts[2])
+            labels.append(parts[3] != PHINull)
+    return texts, np.array(labels, dtype=bool)
+
+
+def read_tsvs(paths):
+    texts, labels = [], []
+    for path in paths:
+        path_texts, path_labels = read_tsv(path)
+        texts += path_texts
+        labels.append(path_labels)
+    return texts, np.concatenate(labels) if labels else np.zeros(0, dtype=bool)
+
+
+class NullGate:
+    """
+    P(line contains PHI) from hashed character n-grams and word-shape features,
+    lines scoring below the threshold are skipped
+    """
+
+    def __init__(self, num_features=NumFeatures, ngram_range=NgramRange):
+        self.num_features = num_features
+        self.ngram_range = ngram_range
+        self.weights = np.zeros(num_features, dtype=np.float32)
+        self.bias = 0.0
+        self.threshold = 0.5
+
+    def features(self, text):
+        """
+        feature indices of one line (duplicates count as repeated features)
+        n-grams are hashed into [0, num_features - len(ShapePatterns)), the last indices are the word shapes
+        """
+        codes = np.frombuffer(text.encode("utf-32-le"), dtype=np.uint32).astype(np.uint64)
+        num_buckets = np.uint64(self.num_features - len(ShapePatterns))
+        indices = []
+        for n in range(self.ngram_range[0], self.ngram_range[1] + 1):
+            if len(codes) < n:
+                break
+            hashes = np.full(len(codes) - n + 1, n, dtype=np.uint64)
+            for k in range(n):
+                hashes = hashes * HashBase + codes[k:len(codes) - n + 1 + k]
+            indices.append(hashes % num_buckets)
+        shapes = [idx for idx, pattern in enumerate(ShapePatterns) if pattern.search(text)]
+        indices.append(np.array([self.num_features - 1 - idx for idx in shapes], dtype=np.uint64))
+        return np.concatenate(indices).astype(np.int64)
+
+    def score_features(self, features):
+        if len(features) == 0:
+            return 1 / (1 + np.exp(-self.bias))
+        logit = self.weights[features].sum() / np.sqrt(len(features)) + self.bias
+        return 1 / (1 + np.exp(-logit))
+
+    def fit(self, texts, labels, epochs=5, learning_rate=0.5, l2=1e-6, seed=RandomSeed):
+        """
+        SGD over the lines, PHI lines weighted up to balance the PHI:Null majority
+        """
+        rng = np.random.default_rng(seed)
+        features = [self.features(text) for text in texts]
+        positive_weight = (len(labels) - labels.sum()) / max(labels.sum(), 1)
+        for _ in range(epochs):
+            for i in rng.permutation(len(texts)):
+                feats = features[i]
+                error = self.score_features(feats) - labels[i]
+                if labels[i]:
+                    error *= positive_weight
+                scale = 1 / np.sqrt(len(feats)) if len(feats) else 0.0
+                np.add.at(self.weights, feats, -learning_rate * (error * scale + l2 * self.weights[feats]))
+                self.bias -= learning_rate * error * 0.01
+        return self
+
+    def scores(self, texts):
+        return np.array([self.score_features(self.features(text)) for text in texts])
+
+    def calibrate(self, texts, labels, target_recall=TargetRecall):
+        """
+        highest threshold that keeps at least target_recall of the PHI lines
+        """
+        positive_scores = np.sort(self.scores([text for text, label in zip(texts, labels) if label]))
+        if len(positive_scores):
+            missed = int(np.floor(len(positive_scores) * (1 - target_recall)))
+            self.threshold = float(positive_scores[missed])
+        return self.threshold
+
+    def keep(self, texts):
+        return self.scores(texts) >= self.threshold
+
+    def save(self, path):
+        np.savez_compressed(path, weights=self.weights, bias=self.bias, threshold=self.threshold,
+                            ngram_range=np.array(self.ngram_range))
+
+    @classmethod
+    def load(cls, path):
+        data = np.load(path)
+        gate = cls(len(data["weights"]), tuple(int(n) for n in data["ngram_range"]))
+        gate.weights = data["weights"]
+        gate.bias = float(data["bias"])
+        gate.threshold = float(data["threshold"])
+        return gate
+
+
+def filter_rows(gate, val_data, task_prefixes=()):
+    """
+    val_data : inference rows {"fid", "idx", "content"}, content may start with a task prefix
+    output : rows likely to contain PHI, report of the skipped lines
+    """
+    texts = []
+    for row in val_data:
+        content = row["content"]
+        for prefix in task_prefixes:
+            if content.startswith(prefix):
+                content = content[len(prefix):]
+                break
+        texts.append(content)
+    mask = gate.keep(texts)
+    kept = [row for row, keep in zip(val_data, mask) if keep]
+    report = {"total": len(val_data), "kept": len(kept), "skipped": len(val_data) - len(kept),
+              "threshold": gate.threshold}
+    return kept, report
+
+
+def evaluate_gate(gate, texts, labels):
+    """
+    recall of the PHI lines and share of PHI:Null lines skipped
+    """
+    mask = gate.keep(texts)
+    return {
+        "recall": float(mask[labels].mean()) if labels.any() else 1.0,
+        "null_skipped": float((~mask[~labels]).mean()) if (~labels).any() else 0.0,
+        "skipped": float((~mask).mean()) if len(mask) else 0.0,
+    }
+
+
+if __name__ == "__main__":
+    data_path = os.path.join(os.getcwd(), "data")
+    train_texts, train_labels = read_tsvs(sorted(glob.glob(os.path.join(data_path, "train_phase*_v8_*_train.tsv"))))
+    test_texts, test_labels = read_tsvs(sorted(glob.glob(os.path.join(data_path, "train_phase*_v8_*_test.tsv"))))
+    print(f"train {len(train_texts)} lines, test {len(test_texts)} lines")
+
+    # calibrate the threshold on one half of the test lines, report on the other half
+    calibration = np.arange(len(test_texts)) % 2 == 0
+    gate = NullGate().fit(train_texts, train_labels)
+    threshold = gate.calibrate([text for text, cal in zip(test_texts, calibration) if cal],
+                               test_labels[calibration], TargetRecall)
+    held_out = [text for text, cal in zip(test_texts, calibration) if not cal]
+    print(f"threshold {threshold:.4f}:", evaluate_gate(gate, held_out, test_labels[~calibration]))
+    gate.save(os.path.join(data_path, "null_gate.npz"))
@@ -7,6 +7,7 @@ Created on Thu Nov 30 17:17:28 2023
 """
 
 import re 
+from functools import lru_cache
 
 PhiCategory = [
     "PATIENT", "DOCTOR", "USERNAME", "PROFESSION", "ROOM", "DEPARTMENT", "HOSPITAL",
@@ -23,17 +24,58 @@ PATIENTKey = ["PANCREAS", "Vessels", "HOOKWIRE", "SGP", "IMMUNOSTAINS", "Vessels
 CommonCountry = ['United States', 'United Kingdom', 'South Korea', 'Saudi Arabia',
                   'South Africa','United Arab Emirates','South Africa','New Zealand']
 
+"""Compiled rule registry: static patterns are built once at import"""
+RulePatterns = {
+    "label": re.compile(r"([A-Z-]+):([^\n=>]+)(=>[^\n]+)?"),
+    "duration": re.compile(
+        r"(\b\d{1,2}-\d{1,2}\s*|\b\d+\s*)(day|week|month|year|dy|wk|mth|yr)s?\b(?!\s*old)",
+        re.IGNORECASE
+    ),
+    "number": re.compile(r"\b\d+\b"),
+    "location_other": re.compile(r"(P\.O\.\s+BOX \d+|PO\s+BOX \d+)", re.IGNORECASE),
+    "country": re.compile(
+        r'\b(?:' + '|'.join(re.escape(country) for country in CommonCountry) + r')\b', re.IGNORECASE
+    ),
+    "time": [
+        re.compile(r"\b(\d{1,2}:\d{2}[ap]m\s+on\s+\d{1,2}[./]\d{1,2}[./]\d{2,4})\b"),
+        re.compile(r"(\d{1,2}[:.]\d{2}[ap]m\s+(?:on\s+|at\s+)?\d{1,2}[./]\d{1,2}[./]\d{2,4})"),
+    ],
+    "date": re.compile(r"(\d{2}/\d{2}/\d{4})"),
+}
+
+
+"""Patterns depending on the predicted content, cached per content"""
+@lru_cache(maxsize=4096)
+def keyword_pattern(partial_name, keywords):
+    return re.compile(r"\b" + re.escape(partial_name) + r".*?\b(?:" + "|".join(keywords) + r")\b")
+
+
+@lru_cache(maxsize=4096)
+def age_pattern(number, unit):
+    return re.compile(r"\b" + re.escape(number) + r"\s*" + re.escape(unit) + r"\s*old\b", re.IGNORECASE)
+
+
+@lru_cache(maxsize=4096)
+def full_time_pattern(date):
+    return re.compile(re.escape(date) + r'\s+(at|on)\s+(\d{1,2}:\d{1,2})')
+
+
+@lru_cache(maxsize=4096)
+def patient_pattern(partial_word):
+    return re.compile(re.escape(partial_word) + r'\w*')
+
+
 def extract_label_info(label):
     """
     get label information from label string
     """
-    pattern = r"([A-Z-]+):([^\n=>]+)(=>[^\n]+)?"
+    pattern = RulePatterns["label"]
     # label_parts = label.split("\\n")
     label_parts = label.split("++")
     extracted_info = []
 
     for part in label_parts:
-        matches = re.findall(pattern, part)
+        matches = pattern.findall(part)
         for match in matches:
             category, content, norm = match
             extracted_info.append((category, content.strip(), norm.strip()))
@@ -80,17 +122,14 @@ def label_clean(label_info):
 def complete_hospital(sentence, partial_name):
     for key in HOSPITALKey:
         if key in sentence and key not in partial_name:
-            pattern = r"\b" + re.escape(partial_name) + r".*?\b(?:" + "|".join(HOSPITALKey) + r")\b"
-            match = re.search(pattern, sentence)
+            match = keyword_pattern(partial_name, tuple(HOSPITALKey)).search(sentence)
 
             if not match:
-                pattern = r"\b" + re.escape(partial_name) + r".*?\b(?:HEALTH)\b"
-                match = re.search(pattern, sentence)
+                match = keyword_pattern(partial_name, ("HEALTH",)).search(sentence)
 
             if not match:
                 partial_name = partial_name.split(" ")[0]
-                pattern = r"\b" + re.escape(partial_name) + r".*?\b(?:" + "|".join(HOSPITALKey) + r")\b"
-                match = re.search(pattern, sentence)
+                match = keyword_pattern(partial_name, tuple(HOSPITALKey)).search(sentence)
 
             return match.group(0) if match else partial_name
 
@@ -98,13 +137,8 @@ def complete_hospital(sentence, partial_name):
 
 
 def complete_time_v1(sentence, partial_time):
-    time_patterns = [
-        r"\b(\d{1,2}:\d{2}[ap]m\s+on\s+\d{1,2}[./]\d{1,2}[./]\d{2,4})\b",
-        r"(\d{1,2}[:.]\d{2}[ap]m\s+(?:on\s+|at\s+)?\d{1,2}[./]\d{1,2}[./]\d{2,4})"
-    ]
-
-    for pattern in time_patterns:
-        match = re.search(pattern, sentence)
+    for pattern in RulePatterns["time"]:
+        match = pattern.search(sentence)
         if match:
             return match.group(1)
 
@@ -113,16 +147,14 @@ def complete_time_v1(sentence, partial_time):
 
 def complete_time_v2(sentence, partial_time):
     # Check if the partial_time follows the pattern "TIME:DD/MM/YYYY"
-    date_pattern = r"(\d{2}/\d{2}/\d{4})"
-    date_match = re.search(date_pattern, partial_time)
+    date_match = RulePatterns["date"].search(partial_time)
 
     if date_match:
         # Extract the date from the partial_time
         date = date_match.group(1)
         # Create a pattern to match the full time based on the extracted date
         # The pattern looks for "at" or "on" followed by the time hh:mm
-        full_time_pattern = re.escape(date) + r'\s+(at|on)\s+(\d{1,2}:\d{1,2})'
-        full_time_match = re.search(full_time_pattern, sentence)
+        full_time_match = full_time_pattern(date).search(sentence)
 
         if full_time_match:
             # Construct the full time string
@@ -137,14 +169,12 @@ def complete_organization(sentence, partial_name):
     for key in ORGANIZATIONKey:
         if key in sentence and key not in partial_name:
             # 构建正则表达式以匹配完整的组织名称
-            pattern = r"\b" + re.escape(partial_name) + r".*?\b(?:" + "|".join(ORGANIZATIONKey) + r")\b"
-            match = re.search(pattern, sentence)
+            match = keyword_pattern(partial_name, tuple(ORGANIZATIONKey)).search(sentence)
 
             if not match:
                 # 如果没有匹配，尝试只用 partial_name 的第一个词
                 partial_name_first_word = partial_name.split(" ")[0]
-                pattern = r"\b" + re.escape(partial_name_first_word) + r".*?\b(?:" + "|".join(ORGANIZATIONKey) + r")\b"
-                match = re.search(pattern, sentence)
+                match = keyword_pattern(partial_name_first_word, tuple(ORGANIZATIONKey)).search(sentence)
 
             return match.group(0) if match else partial_name
 
@@ -153,8 +183,7 @@ def complete_organization(sentence, partial_name):
 
 def complete_patient(sentence, partial_word):
     # Create a pattern that matches the partial_word followed by any word characters until a space or end of string
-    pattern = re.escape(partial_word) + r'\w*'
-    match = re.search(pattern, sentence)
+    match = patient_pattern(partial_word).search(sentence)
     return match.group(0) if match else partial_word
 
     
@@ -175,79 +204,73 @@ def content_revision(sentence, label_info):
 
 """Remedy3: Detect content from sentence"""
 def duration_detection(sentence):
-    # Compile a regular expression pattern to match durations in the sentence
-    duration_pattern = re.compile(
-        r"(\b\d{1,2}-\d{1,2}\s*|\b\d+\s*)(day|week|month|year|dy|wk|mth|yr)s?\b(?!\s*old)", 
-        re.IGNORECASE
-    )
-
-    matches = duration_pattern.findall(sentence)
+    matches = RulePatterns["duration"].findall(sentence)
     durations = []
     for match in matches:
         full_match = "".join(match).strip()
-        age_pattern = r"\b" + re.escape(match[0]) + r"\s*" + re.escape(match[1]) + r"\s*old\b"
-        if not re.search(age_pattern, sentence, re.IGNORECASE):
+        if not age_pattern(match[0], match[1]).search(sentence):
             durations.append(full_match)
 
     if durations:
-        nums = re.findall(r"\b\d+\b", durations[0])
+        nums = RulePatterns["number"].findall(durations[0])
         if nums and int(nums[0]) <= 20:
             return durations[0]
 
 def location_other_detection(sentence):
     # pattern = r"(P\.O\. BOX \d+|PO BOX \d+)"
-    pattern = r"(P\.O\.\s+BOX \d+|PO\s+BOX \d+)"
-    matches = re.findall(pattern, sentence, re.IGNORECASE)
+    matches = RulePatterns["location_other"].findall(sentence)
     
     return matches[0] if matches else None
 
 def country_detection(sentence):
-    # 创建正则表达式模式以匹配国家列表中的任何国家名
-    pattern = r'\b(?:' + '|'.join(re.escape(country) for country in CommonCountry) + r')\b'
-    # 使用 re.IGNORECASE 使匹配对大小写不敏感
-    matches = re.findall(pattern, sentence, re.IGNORECASE)
+    # 国家列表中的任何国家名, 对大小写不敏感
+    matches = RulePatterns["country"].findall(sentence)
     
     return matches[0] if matches else None
 
 
-def age_in_date_detection(sentence, infos):
+def age_in_date_detection(sentence, label_infos):
+    """
+    drop an AGE label whose content only occurs inside a DATE label of the line
+    label_infos : parsed labels (extract_label_info), parsed once per line by the caller
+    """
     age = None
     if "Page: 2" in sentence:
         sentence = sentence.replace("Page: 2", "")
-    if "DATE:" in infos and "AGE:" in infos:
-        labels = extract_label_info(infos)
-        for label in labels:
-            cat, content, _ = label
+    cats = {cat for cat, _, _ in label_infos}
+    if "DATE" in cats and "AGE" in cats:
+        for cat, content, _ in label_infos:
             if cat == "DATE":
                 sentence = sentence.replace(content, "")
             if cat == "AGE":
                 age = content
         if age and age not in sentence:
-            if "++AGE:" in infos:
-                infos = infos.replace(f"++AGE:{age}", "")
-            elif "AGE:" in infos:
-                infos = infos.replace(f"AGE:{age}", "")
-    return infos
+            label_infos = [label for label in label_infos if label[:2] != ("AGE", age)]
+    return label_infos
 
 
-def detection(sentence, infos):
+def detection(sentence, label_infos):
+    """
+    label_infos : parsed labels of the line, the detected ones are appended to a new list
+    """
+    label_infos = list(label_infos)
     #duration detection
     duration = duration_detection(sentence)
     if duration:
         if duration + "s" in sentence:
             duration += "s"
-        infos += f"++DURATION:{duration}"
+        label_infos.append(("DURATION", duration, ""))
     # location detection
     location_other = location_other_detection(sentence)
     if location_other:
-        infos += f"++LOCATION-OTHER:{location_other}"
+        label_infos.append(("LOCATION-OTHER", location_other, ""))
     # country detection
     country = country_detection(sentence)
     if country:
-        infos += f"++COUNTRY:{country}"
+        label_infos.append(("COUNTRY", country, ""))
     # age in date detection
-    infos = age_in_date_detection(sentence, infos)
-    return infos
+    label_infos = age_in_date_detection(sentence, label_infos)
+    return label_infos
     
 
 """Remedy4: Revise ORGANIZATION over recall"""
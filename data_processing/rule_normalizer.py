@@ -0,0 +1,193 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Rule-based DATE / TIME / DURATION / SET normalization, a fast path before the seq2seq model
+
+@author: huangpaveen
+"""
+
+import os
+import re
+
+from num2words import num2words
+
+import data_forge as DataF
+import normalization as NM
+
+RuleCategories = ["DATE", "TIME", "DURATION", "SET"]
+NumberWords = {num2words(num): num for num in range(1, 101)}
+DurationUnits = {
+    "D": ["day", "days", "dy", "dys"],
+    "W": ["week", "weeks", "wk", "wks"],
+    "M": ["month", "months", "mth", "mths"],
+    "Y": ["year", "years", "yr", "yrs"],
+}
+UnitCodes = {unit: code for code, units in DurationUnits.items() for unit in units}
+SetFrequencies = {"once": 1, "twice": 2, "thrice": 3}
+# words allowed around the date and the clock time of a TIME span
+TimeFillers = {"at", "on", "the", "of"}
+
+"""Compiled patterns"""
+DatePattern = re.compile(r"^(\d{1,2})[./](\d{1,2})[./](\d{2}|\d{4})$|^(\d{4})(\d{2})(\d{2})$")
+TimeDatePattern = re.compile(r"(?<![\d./])(\d{1,2})[./](\d{1,2})[./](\d{2}|\d{4})(?![\d./])")
+ClockPattern = re.compile(
+    r"(?<![\d.:])(?:(\d{1,2})[:.](\d{2})|(\d{2})(\d{2}))\s*(am|pm|hrs?)?(?![\d.:])", re.IGNORECASE
+)
+DurationPattern = re.compile(
+    r"^(\d+|[a-z-]+)(?:\s*-\s*(\d+))?\s*(" + "|".join(sorted(UnitCodes, key=len, reverse=True)) + r")$"
+)
+SetPattern = re.compile(r"^(\w+)(?:\s+times)?$")
+
+
+"""Rules"""
+
+
+def date_rule(content, century):
+    """
+    D/M/YYYY, D.M.YY and YYYYMMDD dates, day first like normalization.date_normalization
+    output : (normalization, ambiguous), ambiguous when day and month could be swapped
+    """
+    match = DatePattern.match(content.replace(" ", ""))
+    if not match:
+        return None, False
+    if match.group(4):
+        year, month, day = match.group(4), match.group(5), match.group(6)
+        return format_date(day, month, year, century), False
+    day, month, year = match.group(1), match.group(2), match.group(3)
+    # the DATE labels use both orders when day and month are <= 12
+    ambiguous = int(day) <= 12 and int(month) <= 12 and int(day) != int(month)
+    return format_date(day, month, year, century), ambiguous
+
+
+def format_date(day, month, year, century):
+    if not (1 <= int(month) <= 12 and 1 <= int(day) <= 31):
+        return None
+    if len(year) == 2:
+        year = century + year
+    return f"{year}-{month.zfill(2)}-{day.zfill(2)}"
+
+
+def time_rule(content, century):
+    """
+    one date and one clock time, e.g. "4:50pm on 08.03.65", "16/05/2012 at 12:56", "1217Hrs on 27.2.14"
+    """
+    dates = list(TimeDatePattern.finditer(content))
+    if len(dates) != 1:
+        return None
+    date = format_date(*dates[0].groups(), century)
+    rest = content[:dates[0].start()] + " " + content[dates[0].end():]
+    clocks = list(ClockPattern.finditer(rest))
+    if not date or len(clocks) != 1:
+        return None
+    clock = clocks[0]
+    leftover = (rest[:clock.start()] + " " + rest[clock.end():]).lower().split()
+    if any(word not in TimeFillers for word in leftover):
+        return None
+
+    hours, minutes = (clock.group(1), clock.group(2)) if clock.group(1) else (clock.group(3), clock.group(4))
+    hours, minutes = int(hours), int(minutes)
+    part_of_day = (clock.group(5) or "").lower()
+    if part_of_day == "pm" and hours < 12:
+        hours += 12
+    elif part_of_day == "am" and hours == 12:
+        hours = 0
+    if hours > 23 or minutes > 59:
+        return None
+    return f"{date}T{hours:02d}:{minutes:02d}"
+
+
+def duration_rule(content):
+    """
+    "3 weeks", "ten day", "6years", ranges "6-11 days" -> mean as in data_forge.calculate_range_mean
+    """
+    match = DurationPattern.match(content.strip().lower())
+    if not match:
+        return None
+    quantity, range_end, unit = match.groups()
+    quantity = int(quantity) if quantity.isdigit() else NumberWords.get(quantity)
+    if not quantity:
+        return None
+    if range_end:
+        range_num = int(range_end) - quantity
+        if range_num <= 0:
+            return None
+        quantity = DataF.calculate_range_mean(quantity, range_num)
+    return f"P{quantity}{UnitCodes[unit]}"
+
+
+def set_rule(content):
+    """
+    "once", "twice", "three times", "5 times" -> R1, R2, R3, R5
+    """
+    text = content.strip().lower()
+    match = SetPattern.match(text)
+    if not match:
+        return None
+    word = match.group(1)
+    if word in SetFrequencies and text == word:
+        return f"R{SetFrequencies[word]}"
+    if text == word:
+        return None
+    count = int(word) if word.isdigit() else NumberWords.get(word)
+    return f"R{count}" if count else None
+
+
+def rule_normalize(category, content, century=None):
+    """
+    output : (normalization, confident)
+             confident is False when no rule covers the whole span, or the day-first guess of an
+             ambiguous date is returned, and the model has to answer
+    """
+    century = century or NM.current_century()
+    if category == "DATE":
+        normalization, ambiguous = date_rule(content, century)
+        return normalization, normalization is not None and not ambiguous
+    elif category == "TIME":
+        normalization = time_rule(content, century)
+    elif category == "DURATION":
+        normalization = duration_rule(content)
+    elif category == "SET":
+        normalization = set_rule(content)
+    else:
+        normalization = None
+    return normalization, normalization is not None
+
+
+def split_by_rules(rows, century=None):
+    """
+    rows : answer lines split by tab (fid, category, start, end, content)
+    output : {row index: normalization} resolved by rules, row indices left for the model
+    """
+    century = century or NM.current_century()
+    resolved, unresolved = {}, []
+    for idx, parts in enumerate(rows):
+        if parts[1] not in RuleCategories:
+            continue
+        normalization, confident = rule_normalize(parts[1], parts[4], century)
+        if confident:
+            resolved[idx] = normalization
+        else:
+            unresolved.append(idx)
+    return resolved, unresolved
+
+
+if __name__ == "__main__":
+    # rule coverage and accuracy on the task2 training data ("CATEGORY:content\tnormalization")
+    path = os.path.join(os.getcwd(), "data")
+    stats = {cat: {"total": 0, "resolved": 0, "correct": 0} for cat in RuleCategories}
+    for name in ["train_phase1_v3_task2.tsv", "train_phase2_v3_task2.tsv"]:
+        with open(os.path.join(path, name), "r", encoding="utf-8") as fr:
+            for line in fr:
+                parts = line.rstrip("\n").split("\t")
+                if len(parts) != 2 or ":" not in parts[0]:
+                    continue
+                category, content = parts[0].split(":", 1)
+                if category not in stats:
+                    continue
+                normalization, confident = rule_normalize(category, content, "20")
+                stats[category]["total"] += 1
+                if confident:
+                    stats[category]["resolved"] += 1
+                    stats[category]["correct"] += normalization == parts[1]
+    for category, stat in stats.items():
+        print(f"{category}: resolved {stat['resolved']}/{stat['total']}, correct {stat['correct']}/{stat['resolved']}")
@@ -0,0 +1,199 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Streaming task1 training data: TSV rows (fid, idx, content, label) read lazily, without load_dataset + list()
+
+@author: huangpaveen
+"""
+
+import os
+import random
+import itertools
+
+import torch
+
+import task_prefix as TP
+
+"""Data Setting"""
+PHINull = "PHI:Null"
+PHINullRatio = 0.3
+"""Batch Setting"""
+PoolFactor = 100
+ShuffleBuffer = 8192
+RandomSeed = 1025
+
+
+def read_rows(path, task_prefix=""):
+    """
+    one dict per line like data_reading + add_prefix_to_dataset: fid, idx, content (with prefix), label
+    """
+    with open(path, "r", encoding="utf-8") as fr:
+        for line in fr:
+            parts = line.rstrip("\n").split("\t")
+            if len(parts) < 4:
+                continue
+            yield {"fid": parts[0], "idx": int(parts[1]), "content": task_prefix + parts[2], "label": parts[3]}
+
+
+def count_labels(paths):
+    """
+    PHI:Null and other line counts, one pass over the label column
+    """
+    phi_null, others = 0, 0
+    for path in paths:
+        with open(path, "r", encoding="utf-8") as fr:
+            for line in fr:
+                parts = line.rstrip("\n").split("\t")
+                if len(parts) < 4:
+                    continue
+                if parts[3] == PHINull:
+                    phi_null += 1
+                else:
+                    others += 1
+    return phi_null, others
+
+
+class StreamingOpenDeid(torch.utils.data.IterableDataset):
+    """
+    iterable dataset yielding batches (lists of row dicts), use DataLoader(dataset, batch_size=None, collate_fn=...)
+
+    sources : (tsv path, task prefix) list
+    ratio : PHI:Null rows kept, at most ratio * (other rows) as filter_phi_null_ratio, None keeps all rows
+    batches : OpenDeidBatchSampler style, shuffled rows pooled by batch_size * PoolFactor,
+              each pool sorted by content length (longest first) and cut into batches
+    num_workers : the DataLoader num_workers, rows are split between the workers and len() counts
+                  the batches of every worker
+    """
+
+    def __init__(self, sources, batch_size, ratio=PHINullRatio, shuffle=True, pool_factor=PoolFactor,
+                 shuffle_buffer=ShuffleBuffer, seed=RandomSeed, num_workers=0):
+        super().__init__()
+        self.num_workers = max(num_workers, 1)
+        self.sources = sources
+        self.batch_size = batch_size
+        self.ratio = ratio
+        self.shuffle = shuffle
+        self.pool_size = batch_size * pool_factor
+        self.shuffle_buffer = shuffle_buffer
+        self.seed = seed
+        self.epoch = 0
+        self.phi_null_count, self.other_count = count_labels([path for path, _ in sources])
+        if ratio is None:
+            self.target_phi_null_count = self.phi_null_count
+        else:
+            self.target_phi_null_count = int(min(self.phi_null_count, self.other_count * ratio))
+        self.num_rows = self.other_count + self.target_phi_null_count
+
+    def set_epoch(self, epoch):
+        """
+        another null sample and row order every epoch
+        """
+        self.epoch = epoch
+
+    def __len__(self):
+        worker_rows = [
+            self.num_rows // self.num_workers + (worker_id < self.num_rows % self.num_workers)
+            for worker_id in range(self.num_workers)
+        ]
+        return sum((rows + self.batch_size - 1) // self.batch_size for rows in worker_rows)
+
+    def sampled_rows(self, rng):
+        """
+        sources in a random order, PHI:Null rows kept by selection sampling:
+        exactly target_phi_null_count of them, each with the same probability
+        """
+        sources = list(self.sources)
+        if self.shuffle:
+            rng.shuffle(sources)
+        needed, remaining = self.target_phi_null_count, self.phi_null_count
+        for path, task_prefix in sources:
+            for row in read_rows(path, task_prefix):
+                if row["label"] == PHINull:
+                    keep = rng.random() * remaining < needed
+                    remaining -= 1
+                    if not keep:
+                        continue
+                    needed -= 1
+                yield row
+
+    def shuffled_rows(self, rows, rng):
+        """
+        rows drawn at random from a buffer of shuffle_buffer rows
+        """
+        buffer = []
+        for row in rows:
+            if len(buffer) < self.shuffle_buffer:
+                buffer.append(row)
+                continue
+            idx = rng.randrange(len(buffer))
+            yield buffer[idx]
+            buffer[idx] = row
+        rng.shuffle(buffer)
+        yield from buffer
+
+    def pool_batches(self, pool, rng):
+        pool.sort(key=lambda row: len(row["content"]), reverse=True)
+        batches = [pool[i:i + self.batch_size] for i in range(0, len(pool), self.batch_size)]
+        if self.shuffle:
+            rng.shuffle(batches)
+        return batches
+
+    def __iter__(self):
+        worker_info = torch.utils.data.get_worker_info()
+        worker_id, num_workers = (worker_info.id, worker_info.num_workers) if worker_info else (0, 1)
+        if num_workers != self.num_workers:
+            raise ValueError(f"StreamingOpenDeid built for {self.num_workers} workers, run with {num_workers}")
+        # every worker draws the same null sample and takes every num_workers-th row of it,
+        # the shuffle buffer and the pools use a seed of their own
+        rows = itertools.islice(self.sampled_rows(random.Random(self.seed + self.epoch)), worker_id, None, num_workers)
+        rng = random.Random(f"{self.seed}-{self.epoch}-{worker_id}")
+        if self.shuffle:
+            rows = self.shuffled_rows(rows, rng)
+        pool = []
+        for row in rows:
+            pool.append(row)
+            if len(pool) == self.pool_size:
+                yield from self.pool_batches(pool, rng)
+                pool = []
+        if pool:
+            yield from self.pool_batches(pool, rng)
+
+
+if __name__ == "__main__":
+    from transformers import AutoTokenizer
+
+    import token_cache as TC
+
+    data_path = os.path.join(os.getcwd(), "data")
+    batch_size = 8
+    sources = {
+        split: [
+            (os.path.join(data_path, f"train_phase{phase}_v8_{kind}_{split}.tsv"), prefix)
+            for kind, prefix in TP.TaskPrefixes.items() for phase in [1, 2]
+            if os.path.exists(os.path.join(data_path, f"train_phase{phase}_v8_{kind}_{split}.tsv"))
+        ]
+        for split in ["train", "test"]
+    }
+    train_data = StreamingOpenDeid(sources["train"], batch_size, num_workers=2)
+    test_data = StreamingOpenDeid(sources["test"], 1, shuffle=False)
+    print(f"train: PHI null {train_data.phi_null_count}, others {train_data.other_count}, "
+          f"rows {train_data.num_rows}, batches {len(train_data)}")
+
+    tokenizer = AutoTokenizer.from_pretrained("EleutherAI/pythia-160m", revision="step3000")
+    tokenizer.padding_side = "left"
+    tokenizer.add_special_tokens({"eos_token": "<|END|>", "bos_token": "<|endoftext|>", "pad_token": "<|pad|>",
+                                  "sep_token": "\n\n####\n\n"})
+
+    def collate_batch_with_prompt_template(batch, template=TC.Template):
+        texts = [template.replace("__LABEL__", data["label"]).replace("__CONTENT__", data["content"])
+                 for data in batch]
+        encoded_seq = tokenizer(texts, padding=True, truncation=True, max_length=TC.MaxLen)
+        indexed_tks = torch.tensor(encoded_seq["input_ids"])
+        encoded_label = indexed_tks.clone()
+        encoded_label[encoded_label == tokenizer.pad_token_id] = TC.IgnoredPadIdx
+        return indexed_tks, encoded_label, torch.tensor(encoded_seq["attention_mask"])
+
+    train_dataloader = torch.utils.data.DataLoader(train_data, batch_size=None, num_workers=2,
+                                                   collate_fn=collate_batch_with_prompt_template)
+    input_ids, labels, attention_mask = next(iter(train_dataloader))
+    print(input_ids.shape, labels.shape, attention_mask.shape)
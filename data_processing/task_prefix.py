@@ -0,0 +1,13 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Task1 prompt prefixes, shared by training (token_cache, streaming_data) and inference (inference_task1)
+
+@author: huangpaveen
+"""
+
+TaskPrefixOriginal = "Original records: "
+TaskPrefixSliced = "Sliced records: "
+TaskPrefixSpliced = "Spliced records: "
+# v8 tsv kind (train_phase*_v8_{kind}_*.tsv) -> prefix
+TaskPrefixes = {"original": TaskPrefixOriginal, "sliced": TaskPrefixSliced, "spliced": TaskPrefixSpliced}
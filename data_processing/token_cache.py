@@ -0,0 +1,179 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Pre-tokenized training corpus: one flat int32 token buffer plus offsets, memory-mapped at train time
+
+@author: huangpaveen
+"""
+
+import os
+import json
+import random
+import hashlib
+
+import numpy as np
+import torch
+
+import task_prefix as TP
+
+"""Data Setting"""
+PHINull = "PHI:Null"
+PHINullRatio = 0.3
+IgnoredPadIdx = -100
+MaxLen = 196
+Template = "<|endoftext|> __CONTENT__\n\n####\n\n__LABEL__ <|END|>"
+ChunkSize = 2048
+
+
+def cache_key(tokenizer_name, template, max_length, sources):
+    """
+    tokenizer name, template, max length and source files (size, mtime): any change gives a new cache
+    sources : (tsv path, task prefix) list
+    """
+    key = {
+        "tokenizer": tokenizer_name,
+        "template": hashlib.sha1(template.encode("utf-8")).hexdigest(),
+        "max_length": max_length,
+        "sources": [
+            [os.path.abspath(path), prefix, os.path.getsize(path), int(os.path.getmtime(path))]
+            for path, prefix in sources
+        ],
+    }
+    return hashlib.sha1(json.dumps(key, sort_keys=True).encode("utf-8")).hexdigest()[:16], key
+
+
+def read_rows(path):
+    """
+    v8 tsv rows (fid, idx, content, label)
+    """
+    with open(path, "r", encoding="utf-8") as fr:
+        for line in fr:
+            parts = line.rstrip("\n").split("\t")
+            if len(parts) >= 4:
+                yield parts[:4]
+
+
+def build_cache(cache_dir, tokenizer, sources, template=Template, max_length=MaxLen):
+    """
+    tokenize every row once: tokens.bin (int32), offsets.npy (int64, rows + 1), null.npy (PHI:Null rows)
+    """
+    os.makedirs(cache_dir, exist_ok=True)
+    offsets, nulls, texts = [0], [], []
+    with open(os.path.join(cache_dir, "tokens.bin"), "wb") as fw:
+
+        def flush():
+            for ids in tokenizer(texts, truncation=True, max_length=max_length)["input_ids"]:
+                fw.write(np.asarray(ids, dtype=np.int32).tobytes())
+                offsets.append(offsets[-1] + len(ids))
+            texts.clear()
+
+        for path, prefix in sources:
+            for _, _, content, label in read_rows(path):
+                texts.append(template.replace("__LABEL__", label).replace("__CONTENT__", prefix + content))
+                nulls.append(label == PHINull)
+                if len(texts) >= ChunkSize:
+                    flush()
+        flush()
+    np.save(os.path.join(cache_dir, "offsets.npy"), np.asarray(offsets, dtype=np.int64))
+    np.save(os.path.join(cache_dir, "null.npy"), np.asarray(nulls, dtype=bool))
+
+
+class TokenCache(torch.utils.data.Dataset):
+    """
+    memory-mapped token ids of the rows, item i is an int32 array
+    """
+
+    def __init__(self, cache_dir):
+        self.cache_dir = cache_dir
+        self.offsets = np.load(os.path.join(cache_dir, "offsets.npy"))
+        self.nulls = np.load(os.path.join(cache_dir, "null.npy"))
+        size = os.path.getsize(os.path.join(cache_dir, "tokens.bin"))
+        self.tokens = (
+            np.memmap(os.path.join(cache_dir, "tokens.bin"), dtype=np.int32, mode="r")
+            if size else np.zeros(0, dtype=np.int32)
+        )
+        self.lengths = np.diff(self.offsets)
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, idx):
+        return self.tokens[self.offsets[idx]:self.offsets[idx + 1]]
+
+
+def load_or_build(cache_root, tokenizer, tokenizer_name, sources, template=Template, max_length=MaxLen):
+    """
+    TokenCache for the sources, rebuilt when the tokenizer, template, max length or files changed
+    """
+    key, key_info = cache_key(tokenizer_name, template, max_length, sources)
+    cache_dir = os.path.join(cache_root, key)
+    meta_path = os.path.join(cache_dir, "meta.json")
+    if not os.path.exists(meta_path):
+        build_cache(cache_dir, tokenizer, sources, template, max_length)
+        with open(meta_path, "w", encoding="utf-8") as fw:
+            json.dump(key_info, fw, ensure_ascii=False, indent=4)
+    return TokenCache(cache_dir)
+
+
+def filter_phi_null_ratio(cache, ratio=PHINullRatio):
+    """
+    row indices keeping at most ratio * (other rows) PHI:Null rows, shuffled like the notebooks' filter
+    """
+    phi_null_indices = np.flatnonzero(cache.nulls).tolist()
+    other_indices = np.flatnonzero(~cache.nulls).tolist()
+    target_phi_null_count = int(min(len(phi_null_indices), len(other_indices) * ratio))
+    if len(phi_null_indices) > target_phi_null_count:
+        phi_null_indices = random.sample(phi_null_indices, target_phi_null_count)
+    final_indices = phi_null_indices + other_indices
+    random.shuffle(final_indices)
+    return final_indices
+
+
+def collate_tokens(batch, pad_id, padding_side="left", ignored_pad_idx=IgnoredPadIdx):
+    """
+    same tensors as collate_batch_with_prompt_template: padded ids, labels (pad -> -100), attention mask
+    """
+    max_len = max(len(ids) for ids in batch)
+    indexed_tks = np.full((len(batch), max_len), pad_id, dtype=np.int64)
+    attention_mask = np.zeros((len(batch), max_len), dtype=np.int64)
+    for row, ids in enumerate(batch):
+        span = slice(max_len - len(ids), max_len) if padding_side == "left" else slice(0, len(ids))
+        indexed_tks[row, span] = ids
+        attention_mask[row, span] = 1
+    indexed_tks = torch.from_numpy(indexed_tks)
+    encoded_label = indexed_tks.clone()
+    encoded_label[encoded_label == pad_id] = ignored_pad_idx
+    return indexed_tks, encoded_label, torch.from_numpy(attention_mask)
+
+
+if __name__ == "__main__":
+    from transformers import AutoTokenizer
+
+    data_path = os.path.join(os.getcwd(), "data")
+    cache_root = os.path.join(data_path, "token_cache")
+    pretrained_model = "EleutherAI/pythia-160m"
+    special_tokens_dict = {"eos_token": "<|END|>", "bos_token": "<|endoftext|>", "pad_token": "<|pad|>",
+                           "sep_token": "\n\n####\n\n"}
+
+    tokenizer = AutoTokenizer.from_pretrained(pretrained_model, revision="step3000")
+    tokenizer.padding_side = "left"
+    tokenizer.add_special_tokens(special_tokens_dict)
+    # the added special tokens change the ids, so they are part of the cache key
+    tokenizer_name = f"{pretrained_model}@step3000+{len(tokenizer)}"
+
+    for split in ["train", "test"]:
+        sources = [
+            (os.path.join(data_path, f"train_phase{phase}_v8_{kind}_{split}.tsv"), prefix)
+            for kind, prefix in TP.TaskPrefixes.items() for phase in [1, 2]
+        ]
+        sources = [(path, prefix) for path, prefix in sources if os.path.exists(path)]
+        cache = load_or_build(cache_root, tokenizer, tokenizer_name, sources)
+        indices = filter_phi_null_ratio(cache)
+        print(f"{split}: {len(cache)} rows, {len(cache.tokens)} tokens, {len(indices)} after null filter")
+
+        dataloader = torch.utils.data.DataLoader(
+            torch.utils.data.Subset(cache, indices), batch_size=8,
+            collate_fn=lambda batch: collate_tokens(batch, tokenizer.pad_token_id, tokenizer.padding_side),
+        )
+        input_ids, labels, attention_mask = next(iter(dataloader))
+        print(input_ids.shape, labels.shape, attention_mask.shape)
@@ -0,0 +1,202 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Weighted N-model voting for the task1 ensemble
+
+@author: huangpaveen
+"""
+
+import bisect
+import json
+
+import remedy as RM
+
+
+"""Interval index"""
+
+
+class IntervalIndex:
+    """
+    sorted-array index over the candidate spans of one file
+    spans : (start, end, item) with integer offsets, end exclusive
+    """
+
+    def __init__(self, spans):
+        self.spans = sorted(spans, key=lambda x: (x[0], x[1]))
+
+    def __len__(self):
+        return len(self.spans)
+
+    def clusters(self):
+        """
+        linear sweep: groups of spans connected by overlap (nested spans included)
+        """
+        clusters, current, cluster_end = [], [], None
+        for span in self.spans:
+            if current and span[0] < cluster_end:
+                current.append(span)
+                cluster_end = max(cluster_end, span[1])
+            else:
+                if current:
+                    clusters.append(current)
+                current, cluster_end = [span], span[1]
+        if current:
+            clusters.append(current)
+        return clusters
+
+
+"""Model weights"""
+
+
+def uniform_weights(num_models):
+    """
+    every model and category votes with weight 1
+    """
+    return [{} for _ in range(num_models)]
+
+
+def load_weights(weight_path, model_names):
+    """
+    weights json: {model_name: {category: weight}}, missing models vote with weight 1
+    """
+    with open(weight_path, "r", encoding="utf-8") as fr:
+        weight_dict = json.load(fr)
+    return [weight_dict.get(name, {}) for name in model_names]
+
+
+def save_weights(weight_path, model_names, weights):
+    with open(weight_path, "w", encoding="utf-8") as fw:
+        json.dump(dict(zip(model_names, weights)), fw, ensure_ascii=False, indent=4)
+
+
+def compute_weights(answer_paths, gold_path):
+    """
+    per-category F1 of each model's answer file (evaluation.evaluate_macro_f1) as its weights
+    """
+    import evaluation as EV
+
+    true_data = EV.load_data(gold_path)
+    weights = []
+    for answer_path in answer_paths:
+        _, category_f1_scores = EV.evaluate_macro_f1(EV.load_data(answer_path), true_data)
+        weights.append(category_f1_scores)
+    return weights
+
+
+def category_total_weights(weights):
+    """
+    summed weight of all models for each category, used to normalize support to confidence
+    """
+    categories = set(cat for model_weights in weights for cat in model_weights)
+    totals = {cat: sum(model_weights.get(cat, 1.0) for model_weights in weights) for cat in categories}
+    return totals, float(len(weights))
+
+
+"""Candidate scoring"""
+
+
+def collect_candidates(annotated, weights):
+    """
+    annotated: (model_idx, answer line) pairs of one file id
+    each model votes at most once for a (start, end, category) candidate
+
+    output : {(start, end, category): candidate}
+    """
+    candidates = {}
+    for model_idx, output in annotated:
+        parts = output.split("\t")
+        if len(parts) < 5:
+            continue
+        key = (int(parts[2]), int(parts[3]), parts[1])
+        if key not in candidates:
+            candidates[key] = {"count": 0, "support": 0.0, "models": [], "output": output}
+        candidate = candidates[key]
+        if model_idx in candidate["models"]:
+            continue
+        candidate["models"].append(model_idx)
+        candidate["count"] += 1
+        candidate["support"] += weights[model_idx].get(key[2], 1.0)
+    return candidates
+
+
+def score_candidates(candidates, weights, min_confidence=0.0):
+    """
+    apply remedy entry rules and compute confidence = support / total category weight
+    rules that remove votes scale the support by the votes left
+    """
+    totals, default_total = category_total_weights(weights)
+    scored = {}
+    for key, candidate in candidates.items():
+        count = candidate["count"]
+        entry = RM.entry_clean({"count": count, "output": candidate["output"]})
+        if not entry:
+            continue
+        support = candidate["support"] * entry["count"] / count
+        total = totals.get(key[2], default_total)
+        confidence = support / total if total > 0 else 0.0
+        if support <= 0 or confidence < min_confidence:
+            continue
+        scored[key] = dict(candidate, support=support, confidence=confidence)
+    return scored
+
+
+def best_per_span(scored):
+    """
+    keep one category per (start, end): highest support, TIME preferred over DATE on ties
+    """
+    best = {}
+    for key, candidate in scored.items():
+        span = key[:2]
+        rank = (candidate["support"], key[2] == "TIME")
+        if span not in best or rank > best[span][0]:
+            best[span] = (rank, key, candidate)
+    return [(key, candidate) for _, key, candidate in best.values()]
+
+
+def schedule_intervals(spans):
+    """
+    weighted interval scheduling: non-overlapping spans with maximum total support,
+    longer coverage preferred on ties
+
+    spans : ((start, end, category), candidate) list
+    output : selected spans ordered by start
+    """
+    spans = sorted(spans, key=lambda x: (x[0][1], x[0][0]))
+    ends = [key[1] for key, _ in spans]
+    best = [(0.0, 0)]
+    choice = []
+    for j, (key, candidate) in enumerate(spans):
+        start, end, _ = key
+        prev = bisect.bisect_right(ends, start, 0, j)
+        take = (best[prev][0] + candidate["support"], best[prev][1] + end - start)
+        if take > best[j]:
+            best.append(take)
+            choice.append(prev)
+        else:
+            best.append(best[j])
+            choice.append(None)
+
+    selected = []
+    j = len(spans)
+    while j > 0:
+        if choice[j - 1] is None:
+            j -= 1
+        else:
+            selected.append(spans[j - 1])
+            j = choice[j - 1]
+    return selected[::-1]
+
+
+def weighted_vote(annotated, weights, min_confidence=0.0):
+    """
+    weighted vote over the answer lines of one file id
+
+    output : selected ((start, end, category), candidate) list ordered by start
+    """
+    candidates = collect_candidates(annotated, weights)
+    scored = score_candidates(candidates, weights, min_confidence)
+    index = IntervalIndex((key[0], key[1], (key, candidate)) for key, candidate in best_per_span(scored))
+    selected = []
+    for cluster in index.clusters():
+        selected += schedule_intervals([item for _, _, item in cluster])
+    return selected
@@ -0,0 +1,69 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Shared fixtures: data_processing on the import path, tiny tokenizers trained on the repo data (no hub access)
+
+@author: huangpaveen
+"""
+
+import os
+import sys
+import glob
+
+import pytest
+
+RepoPath = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(RepoPath, "data_processing"))
+
+VocabSize = 800
+CorpusLines = 1000
+
+
+def corpus():
+    for path in sorted(glob.glob(os.path.join(RepoPath, "data", "*.tsv"))):
+        with open(path, "r", encoding="utf-8") as fr:
+            for i, line in enumerate(fr):
+                if i >= CorpusLines:
+                    break
+                yield line
+
+
+@pytest.fixture(scope="session")
+def t5_tokenizer():
+    """
+    byte-level BPE with the T5 special tokens: <pad> 0, </s> 1 appended to every input
+    """
+    tokenizers = pytest.importorskip("tokenizers")
+    from tokenizers.processors import TemplateProcessing
+    from transformers import PreTrainedTokenizerFast
+
+    tokenizer = tokenizers.Tokenizer(tokenizers.models.BPE(unk_token="<unk>"))
+    tokenizer.pre_tokenizer = tokenizers.pre_tokenizers.ByteLevel(add_prefix_space=False)
+    tokenizer.decoder = tokenizers.decoders.ByteLevel()
+    tokenizer.train_from_iterator(
+        corpus(), tokenizers.trainers.BpeTrainer(vocab_size=VocabSize, special_tokens=["<pad>", "</s>", "<unk>"])
+    )
+    tokenizer.post_processor = TemplateProcessing(single="$A </s>", special_tokens=[("</s>", 1)])
+    return PreTrainedTokenizerFast(tokenizer_object=tokenizer, pad_token="<pad>", eos_token="</s>", unk_token="<unk>")
+
+
+@pytest.fixture(scope="session")
+def pythia_tokenizer():
+    """
+    byte-level BPE with the special tokens of the pythia notebooks, left padding
+    """
+    tokenizers = pytest.importorskip("tokenizers")
+    from transformers import PreTrainedTokenizerFast
+
+    tokenizer = tokenizers.Tokenizer(tokenizers.models.BPE())
+    tokenizer.pre_tokenizer = tokenizers.pre_tokenizers.ByteLevel(add_prefix_space=False)
+    tokenizer.decoder = tokenizers.decoders.ByteLevel()
+    tokenizer.train_from_iterator(corpus(), tokenizers.trainers.BpeTrainer(
+        vocab_size=VocabSize, special_tokens=["<|endoftext|>"],
+        initial_alphabet=tokenizers.pre_tokenizers.ByteLevel.alphabet(),
+    ))
+    tokenizer = PreTrainedTokenizerFast(tokenizer_object=tokenizer)
+    tokenizer.add_special_tokens({"eos_token": "<|END|>", "bos_token": "<|endoftext|>", "pad_token": "<|pad|>",
+                                  "sep_token": "\n\n####\n\n"})
+    tokenizer.padding_side = "left"
+    return tokenizer
@@ -0,0 +1,38 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+evaluation_cache: cached scores follow the answer files, gold included
+
+@author: huangpaveen
+"""
+
+import evaluation_cache as CA
+import evaluation_core as EC
+
+Pred = "file1\tDOCTOR\t10\t15\tSmith\nfile1\tDATE\t20\t30\t2023-01-01\nfile2\tIDNUM\t5\t12\t12A3456\n"
+Gold = "file1\tDOCTOR\t10\t15\tSmith\nfile1\tDATE\t20\t30\t2023-01-01\nfile2\tIDNUM\t5\t12\t12A3456\n"
+EditedGold = "file1\tDOCTOR\t10\t15\tSmith\nfile1\tDATE\t20\t30\t2023-01-01\nfile2\tMEDICALRECORD\t5\t12\t12A3456\n"
+
+
+def write(path, text):
+    path.write_text(text, encoding="utf-8")
+    return str(path)
+
+
+def test_cached_results_match_evaluate_files(tmp_path):
+    pred_path, gold_path = write(tmp_path / "answer.txt", Pred), write(tmp_path / "gold.txt", Gold)
+    cache = CA.ResultsCache(str(tmp_path / "cache"))
+    first = cache.evaluate(pred_path, gold_path)
+    assert first == EC.evaluate_files(pred_path, gold_path)
+    assert CA.ResultsCache(str(tmp_path / "cache")).evaluate(pred_path, gold_path) == first
+
+
+def test_edited_gold_is_evaluated_again(tmp_path):
+    pred_path, gold_path = write(tmp_path / "answer.txt", Pred), write(tmp_path / "gold.txt", Gold)
+    cache = CA.ResultsCache(str(tmp_path / "cache"))
+    assert cache.evaluate(pred_path, gold_path)["f1"] == 1.0
+    write(tmp_path / "gold.txt", EditedGold)
+    edited = cache.evaluate(pred_path, gold_path)
+    assert edited == EC.evaluate_files(pred_path, gold_path)
+    assert edited["f1"] < 1.0
+    assert CA.ResultsCache(str(tmp_path / "cache")).evaluate(pred_path, gold_path) == edited
@@ -0,0 +1,185 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+inference_task1: prefix key/value cache decoding, early stopping and continuous batching against
+model.generate, on a tiny random pythia (CPU)
+
+@author: huangpaveen
+"""
+
+import os
+
+import pytest
+
+torch = pytest.importorskip("torch")
+transformers = pytest.importorskip("transformers")
+
+import inference_task1 as I1  # noqa: E402
+import task_prefix as TP  # noqa: E402
+from conftest import RepoPath  # noqa: E402
+
+MaxNewTokens = 24
+
+
+@pytest.fixture(scope="module")
+def val_data():
+    data_path = os.path.join(RepoPath, "data")
+    val_data = I1.reading_validation_data(os.path.join(data_path, "valid_phase1_v8_original.tsv"),
+                                          TP.TaskPrefixOriginal)[:40]
+    val_data += I1.reading_validation_data(os.path.join(data_path, "valid_phase1_v8_spliced.tsv"),
+                                           TP.TaskPrefixSpliced)[:20]
+    return val_data
+
+
+@pytest.fixture(scope="module")
+def model(pythia_tokenizer, val_data):
+    torch.manual_seed(0)
+    config = transformers.GPTNeoXConfig(
+        vocab_size=len(pythia_tokenizer), hidden_size=64, intermediate_size=128, num_hidden_layers=2,
+        num_attention_heads=4, max_position_embeddings=512, rotary_pct=1.0, initializer_range=0.2,
+        bos_token_id=pythia_tokenizer.bos_token_id,
+        eos_token_id=pythia_tokenizer.eos_token_id, pad_token_id=pythia_tokenizer.pad_token_id,
+    )
+    model = transformers.GPTNeoXForCausalLM(config).eval()
+    # a random model never picks <|END|>: give it the output row of the token it picks most,
+    # so that rows end at different steps
+    generated = [token for tokens in generate_ids(model, pythia_tokenizer, val_data[:8]) for token in tokens[2:]]
+    token = torch.bincount(torch.tensor(generated)).argmax()
+    with torch.no_grad():
+        weight = model.get_output_embeddings().weight
+        weight[pythia_tokenizer.eos_token_id] = weight[token] * 1.2
+    return model
+
+
+@pytest.fixture(scope="module")
+def prefix_cache(model, pythia_tokenizer):
+    return I1.PrefixCache(model, pythia_tokenizer)
+
+
+def prompt_ids(tokenizer, rows):
+    seeds = [I1.Template.replace("__CONTENT__", row["content"]) for row in rows]
+    return tokenizer(seeds, truncation=True, max_length=I1.MaxLen)["input_ids"]
+
+
+def generate_ids(model, tokenizer, rows, max_new_tokens=MaxNewTokens):
+    """
+    model.generate on the left-padded batch, each row cut after its <|END|>
+    """
+    seeds = [I1.Template.replace("__CONTENT__", row["content"]) for row in rows]
+    inputs = tokenizer(seeds, return_tensors="pt", padding=True, truncation=True, max_length=I1.MaxLen)
+    with torch.no_grad():
+        output_tokens = model.generate(**inputs, max_new_tokens=max_new_tokens, do_sample=False,
+                                       pad_token_id=tokenizer.pad_token_id, eos_token_id=tokenizer.eos_token_id)
+    generated = []
+    for tokens in output_tokens[:, inputs["input_ids"].shape[1]:].tolist():
+        if tokenizer.eos_token_id in tokens:
+            tokens = tokens[:tokens.index(tokenizer.eos_token_id) + 1]
+        generated.append(tokens)
+    return generated
+
+
+def cached_ids(model, tokenizer, prefix_cache, rows, **kwargs):
+    """
+    greedy_generate from the cached prefix the rows share
+    """
+    input_ids = prompt_ids(tokenizer, rows)
+    prefix_idx = prefix_cache.match(input_ids[0])
+    prefix_len = len(prefix_cache.prefix_ids[prefix_idx])
+    with torch.no_grad():
+        return I1.greedy_generate(model, [ids[prefix_len:] for ids in input_ids], tokenizer.pad_token_id,
+                                  tokenizer.eos_token_id, MaxNewTokens, prefix_cache.caches[prefix_idx], prefix_len,
+                                  **kwargs)
+
+
+def stopped(tokens, eos_id, budget, stop_ids=()):
+    """
+    model.generate output cut where greedy_generate stops the row
+    """
+    for length in range(1, len(tokens) + 1):
+        head = tokens[:length]
+        if head[-1] == eos_id or length >= budget:
+            return head
+        if any(head[:len(ids)] == ids for ids in stop_ids if length >= len(ids)):
+            return head
+    return tokens
+
+
+def test_prefix_cache_matches_the_task_prefix(pythia_tokenizer, prefix_cache):
+    for prefix_idx, task_prefix in enumerate(TP.TaskPrefixes.values()):
+        ids = prompt_ids(pythia_tokenizer, [{"content": task_prefix + "Episode No: 89W554818"}])[0]
+        assert prefix_cache.match(ids) == prefix_idx
+    ids = prompt_ids(pythia_tokenizer, [{"content": "Episode No: 89W554818"}])[0]
+    assert prefix_cache.match(ids) is None
+
+
+def test_repeat_and_select_cache(prefix_cache):
+    cache = prefix_cache.caches[0]
+    repeated = I1.repeat_cache(cache, 3)
+    selected = I1.select_cache(I1.repeat_cache(cache, 3), torch.tensor([2]))
+    for layer, repeated_layer, selected_layer in zip(cache.layers, repeated.layers, selected.layers):
+        assert repeated_layer.keys.shape[0] == 3
+        assert torch.equal(selected_layer.keys, layer.keys)
+        assert torch.equal(selected_layer.values, layer.values)
+    # the shared prefix cache itself is never modified
+    assert cache.layers[0].keys.shape[0] == 1
+
+
+def test_prefix_cache_decoding_matches_generate(model, pythia_tokenizer, prefix_cache, val_data):
+    for rows in (val_data[:40], val_data[40:]):
+        assert cached_ids(model, pythia_tokenizer, prefix_cache, rows) == generate_ids(model, pythia_tokenizer, rows)
+
+
+def test_predict_rows_with_prefix_cache_matches_aicup_predict(model, pythia_tokenizer, prefix_cache, val_data):
+    expected = []
+    for start in range(0, len(val_data), 16):
+        expected += I1.aicup_predict(model, pythia_tokenizer, val_data[start:start + 16], max_new_tokens=MaxNewTokens)
+    predictions = I1.predict_rows(model, pythia_tokenizer, val_data, max_tokens=16 * 40, max_batch_size=16,
+                                  max_new_tokens=MaxNewTokens, prefix_cache=prefix_cache)
+    assert predictions == expected
+    assert any(prediction is not None for prediction in predictions)
+
+
+"""Early stopping and continuous batching"""
+
+
+@pytest.mark.parametrize("max_batch_size, max_tokens", [(1, None), (4, None), (8, 200), (64, None)])
+def test_continuous_batching_matches_generate(model, pythia_tokenizer, prefix_cache, val_data, max_batch_size,
+                                              max_tokens):
+    rows = val_data[:40]
+    generated = cached_ids(model, pythia_tokenizer, prefix_cache, rows, max_batch_size=max_batch_size,
+                           max_tokens=max_tokens)
+    assert generated == generate_ids(model, pythia_tokenizer, rows)
+
+
+@pytest.mark.parametrize("max_batch_size", [4, 64])
+def test_early_stop_cuts_generate(model, pythia_tokenizer, prefix_cache, val_data, max_batch_size):
+    rows = val_data[:40]
+    expected = generate_ids(model, pythia_tokenizer, rows)
+    # stop on the opening tokens of one row, and budgets from 3 to MaxNewTokens tokens
+    stop_ids = [next(tokens[:2] for tokens in expected if len(tokens) > 2 and tokens[1] != tokens[0])]
+    budgets = [3 + i % (MaxNewTokens - 2) for i in range(len(rows))]
+    expected = [stopped(tokens, pythia_tokenizer.eos_token_id, budget, stop_ids)
+                for tokens, budget in zip(expected, budgets)]
+    assert any(tokens[:2] == stop_ids[0] for tokens in expected)
+
+    generated = cached_ids(model, pythia_tokenizer, prefix_cache, rows, budgets=budgets, stop_ids=stop_ids,
+                           max_batch_size=max_batch_size)
+    assert generated == expected
+
+
+def test_predict_rows_early_stop_matches_cut_generate(model, pythia_tokenizer, prefix_cache, val_data):
+    input_ids = prompt_ids(pythia_tokenizer, val_data)
+    budgets = I1.generation_budgets([len(I1.remove_prefixes(row["content"])) for row in val_data], MaxNewTokens)
+    stop_ids = [pythia_tokenizer(label, add_special_tokens=False)["input_ids"] for label in I1.NullLabels]
+    expected = []
+    for start in range(0, len(val_data), 20):
+        rows = val_data[start:start + 20]
+        for row, ids, tokens, budget in zip(rows, input_ids[start:], generate_ids(model, pythia_tokenizer, rows),
+                                            budgets[start:]):
+            pred = pythia_tokenizer.decode(ids + stopped(tokens, pythia_tokenizer.eos_token_id, budget, stop_ids))
+            expected.append(I1.decode_prediction(pred, row, pythia_tokenizer))
+
+    for cache in (prefix_cache, None):
+        predictions = I1.predict_rows(model, pythia_tokenizer, val_data, max_tokens=16 * 40, max_batch_size=16,
+                                      max_new_tokens=MaxNewTokens, prefix_cache=cache, early_stop=True)
+        assert predictions == expected
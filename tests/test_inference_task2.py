@@ -0,0 +1,106 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+inference_task2: batched, length-bucketed normalization against the notebook's one-span-per-generate loop,
+on a tiny random flan-t5 (CPU)
+
+@author: huangpaveen
+"""
+
+import os
+
+import pytest
+
+torch = pytest.importorskip("torch")
+transformers = pytest.importorskip("transformers")
+
+import inference_task2 as IT  # noqa: E402
+import rule_normalizer as RN  # noqa: E402
+from conftest import RepoPath  # noqa: E402
+
+MaxNewTokens = 12
+
+
+@pytest.fixture(scope="module")
+def model(t5_tokenizer):
+    torch.manual_seed(0)
+    config = transformers.T5Config(vocab_size=len(t5_tokenizer), d_model=64, d_ff=128, num_layers=2, num_heads=4,
+                                   d_kv=16, decoder_start_token_id=0, pad_token_id=0, eos_token_id=1)
+    return transformers.T5ForConditionalGeneration(config).eval()
+
+
+@pytest.fixture(scope="module")
+def rows():
+    """
+    answer rows of the task2 training spans, with non-normalized categories in between
+    """
+    rows = []
+    with open(os.path.join(RepoPath, "data", "train_phase1_v3_task2.tsv"), "r", encoding="utf-8") as fr:
+        for idx, line in enumerate(fr):
+            if idx >= 60:
+                break
+            category, content = line.rstrip("\n").split("\t")[0].split(":", 1)
+            rows.append([f"file{idx % 7}", category, str(idx * 10), str(idx * 10 + len(content)), content])
+            if idx % 5 == 0:
+                rows.append([f"file{idx % 7}", "DOCTOR", str(idx * 10 + 50), str(idx * 10 + 55), "Smith"])
+    return rows
+
+
+def per_span_lines(model, tokenizer, rows):
+    """
+    the PHI_flant5 task2 notebook loop: one generate per span, padded to MaxLen
+    """
+    lines = []
+    for fid, cat, spo, epo, content in (parts[:5] for parts in rows):
+        if cat not in IT.NormCategory:
+            lines.append(f"{fid}\t{cat}\t{spo}\t{epo}\t{content}\n")
+            continue
+        encoded_seq = tokenizer(IT.TaskPrefix + cat + ":" + content, padding="max_length", truncation=True,
+                                max_length=IT.MaxLen, return_tensors="pt")
+        with torch.no_grad():
+            predicted_token = model.generate(input_ids=encoded_seq["input_ids"],
+                                             attention_mask=encoded_seq["attention_mask"],
+                                             max_new_tokens=MaxNewTokens)
+        predicted_string = tokenizer.decode(predicted_token[0].tolist(), skip_special_tokens=True)
+        if predicted_string:
+            lines.append(f"{fid}\t{cat}\t{spo}\t{epo}\t{content}\t{predicted_string}\n")
+        else:
+            lines.append(f"{fid}\t{cat}\t{spo}\t{epo}\t{content}\n")
+    return lines
+
+
+def test_length_batches_cover_every_index_sorted_by_length():
+    lengths = [5, 1, 4, 1, 3, 9, 2]
+    batches = IT.length_batches(lengths, 3)
+    assert sorted(i for batch in batches for i in batch) == list(range(len(lengths)))
+    assert all(len(batch) <= 3 for batch in batches)
+    flat = [lengths[i] for batch in batches for i in batch]
+    assert flat == sorted(flat)
+
+
+@pytest.mark.parametrize("batch_size", [1, 7, 64])
+def test_normalize_answer_file_matches_per_span_loop(model, t5_tokenizer, rows, tmp_path, batch_size):
+    answer_path = tmp_path / "answer.txt"
+    answer_path.write_text("".join("\t".join(parts) + "\n" for parts in rows), encoding="utf-8")
+
+    output_path = IT.normalize_answer_file(model, t5_tokenizer, str(answer_path), batch_size=batch_size,
+                                           max_new_tokens=MaxNewTokens)
+    with open(output_path, "r", encoding="utf-8") as fr:
+        assert fr.readlines() == per_span_lines(model, t5_tokenizer, rows)
+
+
+def test_rules_answer_only_confident_spans(model, t5_tokenizer, rows):
+    model_only = IT.normalize_rows(model, t5_tokenizer, rows, max_new_tokens=MaxNewTokens)
+    with_rules = IT.normalize_rows(model, t5_tokenizer, rows, use_rules=True, max_new_tokens=MaxNewTokens)
+    resolved = 0
+    for parts, expected, normalization in zip(rows, model_only, with_rules):
+        if parts[1] not in IT.NormCategory:
+            assert normalization is None
+            continue
+        rule_answer, confident = RN.rule_normalize(parts[1], parts[4])
+        if confident:
+            resolved += 1
+            assert normalization == rule_answer
+        else:
+            assert normalization == expected
+    assert resolved > 0